@@ -0,0 +1,230 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+import db
+import holds
+import migrations
+import sessions
+import stats
+import writebehind
+from routes import app
+
+# Read-heavy endpoints: run on the reader pool, many at a time
+READ_ENDPOINTS = {
+    'view_products', 'get_product', 'get_product_ratings', 'get_categories', 'dashboard',
+    'get_user_orders', 'get_user_cart', 'get_user_reviews', 'get_user_addresses', 'get_user_payments',
+    'get_user_sessions',
+}
+
+# Endpoints that write to SQLite: run one at a time on the writer thread.
+# SQLite allows a single writer anyway; queueing here instead of on the
+# database lock means writers never spin in busy_timeout against each other.
+WRITE_ENDPOINTS = {
+    'create_order', 'create_category', 'add_to_cart', 'update_cart', 'add_review', 'add_address',
+    'add_payment', 'add_session',
+}
+
+READ_WORKERS = 8
+WORKERS = 4
+DRAIN_TIMEOUT = 30.0
+
+
+class ASGIApp:
+    """ASGI entry point for the Flask app.
+
+    Connections are held by the event loop, so idle and slow clients cost
+    no threads. Each request is handed to a thread only to run its view:
+    read endpoints on the reader pool, write endpoints on the single writer
+    thread and everything else (login, register, exports) on a general
+    pool. Views stay synchronous Flask code; SQLite work never runs on the
+    event loop. On lifespan shutdown new requests get 503 and in-flight
+    ones are drained before the pools and the view queue are stopped.
+    """
+
+    def __init__(self, wsgi_app, read_workers=READ_WORKERS, workers=WORKERS, drain_timeout=DRAIN_TIMEOUT):
+        self.wsgi_app = wsgi_app
+        self.drain_timeout = drain_timeout
+        self.readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='asgi-reader')
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='asgi-writer')
+        self.general = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='asgi-worker')
+        self.adapter = wsgi_app.url_map.bind('localhost')
+
+        # Every executor thread may hold a pooled connection at once
+        pool = db.get_pool()
+        needed = read_workers + workers + 1
+        if pool.size < needed:
+            db.configure(size=needed, timeout=pool.timeout, pragmas=pool.pragmas,
+                         factory=pool.factory, on_connect=pool.on_connect)
+
+        self.inflight = 0
+        self.draining = False
+        self._idle = None
+
+    def executor_for(self, method, path):
+        try:
+            endpoint, _ = self.adapter.match(path, method)
+        except HTTPException:
+            return self.general
+        if endpoint in READ_ENDPOINTS:
+            return self.readers
+        if endpoint in WRITE_ENDPOINTS:
+            return self.writer
+        return self.general
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await asyncio.get_running_loop().run_in_executor(self.general, self.startup)
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def startup(self):
+        migrations.ensure_schema()
+        db.configure_replica(app.config['READ_REPLICA_INTERVAL'])
+        stats.start_reconciler(app.config['STATS_RECONCILE_INTERVAL'])
+        sessions.start_sweeper(app.config['SESSION_SWEEP_INTERVAL'], app.config['SESSION_SWEEP_BATCH'])
+        holds.start_sweeper(app.config['HOLD_SWEEP_INTERVAL'], app.config['HOLD_SWEEP_BATCH'])
+
+    async def drain(self):
+        self.draining = True
+        if self.inflight:
+            self._idle = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                print(f"Shutting down with {self.inflight} requests still in flight")
+
+        loop = asyncio.get_running_loop()
+        for executor in (self.readers, self.writer, self.general):
+            await loop.run_in_executor(None, executor.shutdown)
+        await loop.run_in_executor(None, writebehind.view_queue.stop)
+        db.configure_replica(None)
+        db.get_pool().close()
+
+    async def http(self, scope, receive, send):
+        if self.draining:
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'content-type', b'text/plain'), (b'connection', b'close')]})
+            await send({'type': 'http.response.body', 'body': b'Server is shutting down'})
+            return
+
+        self.inflight += 1
+        try:
+            body = await read_body(receive)
+            environ = build_environ(scope, body)
+            executor = self.executor_for(environ['REQUEST_METHOD'], environ['PATH_INFO'])
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, self.run_wsgi, environ, send, loop)
+        finally:
+            self.inflight -= 1
+            if self.inflight == 0 and self._idle is not None:
+                self._idle.set()
+
+    def run_wsgi(self, environ, send, loop):
+        # Runs on an executor thread; messages are sent back through the loop
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return lambda data: None
+
+        started = False
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not started:
+                    send_message({'type': 'http.response.start', 'status': response['status'],
+                                  'headers': response['headers']})
+                    started = True
+                send_message({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        if not started:
+            send_message({'type': 'http.response.start', 'status': response['status'],
+                          'headers': response['headers']})
+        send_message({'type': 'http.response.body', 'body': b''})
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def build_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+application = ASGIApp(app,
+                      read_workers=app.config.get('ASGI_READ_WORKERS', READ_WORKERS),
+                      workers=app.config.get('ASGI_WORKERS', WORKERS),
+                      drain_timeout=app.config.get('ASGI_DRAIN_TIMEOUT', DRAIN_TIMEOUT))
+
+
+if __name__ == '__main__':
+    # Any ASGI server works, e.g. `uvicorn asgi:application` or `hypercorn asgi:application`
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('Install an ASGI server such as uvicorn to run asgi.py directly')
+    uvicorn.run(application, host='127.0.0.1', port=8000, lifespan='on')
@@ -0,0 +1,505 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlencode
+from jinja2 import ChoiceLoader, DictLoader
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# Load tests for the real routes against a seeded synthetic database.
+# Seeding is pure SQL over a recursive sequence with multiplicative hashing,
+# so a given scale and seed always produces the same database.
+
+SCALES = {
+    'small': {'categories': 20, 'users': 1000, 'products': 10000, 'orders': 20000, 'reviews': 20000, 'carts': 2000},
+    'medium': {'categories': 50, 'users': 20000, 'products': 100000, 'orders': 500000, 'reviews': 200000, 'carts': 40000},
+    'large': {'categories': 200, 'users': 100000, 'products': 1000000, 'orders': 10000000, 'reviews': 1000000, 'carts': 200000},
+}
+
+ITEMS_PER_ORDER = 3
+BENCH_PASSWORD = 'benchmark-password'
+HOT_PRODUCTS = 10
+
+WORDS = ('laptop', 'phone', 'tablet', 'monitor', 'keyboard', 'mouse', 'headset', 'camera', 'speaker', 'router',
+         'charger', 'cable', 'drive', 'printer', 'console', 'controller', 'watch', 'adapter', 'dock', 'webcam',
+         'gaming', 'wireless', 'portable', 'mechanical', 'ultra', 'compact', 'pro', 'mini', 'smart', 'silent')
+STATUSES = ('complete', 'pending', 'shipped')
+
+SORTS = ('newest', 'oldest', 'price_asc', 'price_desc', 'rating')
+
+# The backend ships without its HTML templates; these are only used when the
+# app has none, so HTML routes still render their data instead of failing.
+FALLBACK_TEMPLATES = {
+    'login.html': 'login',
+    'register.html': 'register',
+    'products.html': '{% for p in products or [] %}{{ p.id }} {{ p.name }} {{ p.price }}\n{% endfor %}{{ next_cursor }}',
+    'dashboard.html': '{{ user.name }} {{ user_statistics }}'
+                      '{% for o in recent_orders or [] %} {{ o.id }}{% endfor %}'
+                      '{% for v in recent_views or [] %} {{ v }}{% endfor %}'
+                      '{% for p in recommendations or [] %} {{ p }}{% endfor %}',
+}
+
+
+def _hash(expression, salt):
+    # Deterministic pseudo-random integer in [0, 4294967291) for each row
+    return f'((({expression}) * 2654435761 + {salt} * 40503) % 4294967291)'
+
+
+def _word(expression, salt):
+    return f"json_extract(:words, '$[' || ({_hash(expression, salt)} % {len(WORDS)}) || ']')"
+
+
+def _sequence(count):
+    return f'WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {int(count)})'
+
+
+def _skewed(expression, salt, count):
+    # Product of two uniforms: low ids are bought and reviewed far more often
+    return f'({_hash(expression, salt)} % {count}) * ({_hash(expression, salt + 1)} % {count}) / {count} + 1'
+
+
+def seed_queries(scale, seed=0):
+    s = seed * 100
+    users, products, categories = scale['users'], scale['products'], scale['categories']
+    return [
+        ('categories', f'''
+            {_sequence(categories)}
+            INSERT INTO categories (id, name) SELECT n, 'category ' || n FROM seq;
+        '''),
+        ('users', f'''
+            {_sequence(users)}
+            INSERT INTO users (id, username, name, email, password, date_added)
+            SELECT n, 'user' || n, 'User ' || n, 'user' || n || '@example.com', :password,
+                   datetime('2025-01-01', '+' || ({_hash('n', s + 1)} % 365) || ' days')
+            FROM seq;
+        '''),
+        ('products', f'''
+            {_sequence(products)}
+            INSERT INTO products (id, name, description, price, stock_quantity, category_id, date_added)
+            SELECT n, {_word('n', s + 2)} || ' ' || {_word('n', s + 3)} || ' ' || n,
+                   'Synthetic ' || {_word('n', s + 4)} || ' ' || {_word('n', s + 5)} || ' for load testing',
+                   ({_hash('n', s + 6)} % 200000) / 100.0 + 1, 1000000000,
+                   {_hash('n', s + 7)} % {categories} + 1,
+                   datetime('2026-01-01', '-' || ({_hash('n', s + 8)} % 1000000) || ' minutes')
+            FROM seq;
+        '''),
+        ('orders', f'''
+            {_sequence(scale['orders'])}
+            INSERT INTO orders (id, user_id, total_price, order_date, status)
+            SELECT n, {_hash('n', s + 9)} % {users} + 1, ({_hash('n', s + 10)} % 50000) / 100.0 + 1,
+                   datetime('2026-01-01', '-' || ({_hash('n', s + 11)} % 1000000) || ' minutes'),
+                   json_extract(:statuses, '$[' || ({_hash('n', s + 12)} % {len(STATUSES)}) || ']')
+            FROM seq;
+        '''),
+        ('order_items', f'''
+            {_sequence(scale['orders'] * ITEMS_PER_ORDER)}
+            INSERT INTO order_items (order_id, product_id, quantity, unit_price)
+            SELECT (n - 1) / {ITEMS_PER_ORDER} + 1, {_skewed('n', s + 13, products)},
+                   {_hash('n', s + 15)} % 3 + 1, ({_hash('n', s + 16)} % 20000) / 100.0 + 1
+            FROM seq;
+        '''),
+        ('reviews', f'''
+            {_sequence(scale['reviews'])}
+            INSERT INTO reviews (user_id, product_id, rating, review_text, date_added)
+            SELECT {_hash('n', s + 17)} % {users} + 1, {_skewed('n', s + 18, products)},
+                   5 - ({_hash('n', s + 20)} % 15) / 4, 'Synthetic review ' || n,
+                   datetime('2026-01-01', '-' || ({_hash('n', s + 21)} % 1000000) || ' minutes')
+            FROM seq;
+        '''),
+        ('carts', f'''
+            {_sequence(scale['carts'])}
+            INSERT OR IGNORE INTO carts (user_id, product_id, quantity)
+            SELECT (n - 1) % {users} + 1, {_hash('n', s + 22)} % {products} + 1, {_hash('n', s + 23)} % 3 + 1
+            FROM seq;
+        '''),
+    ]
+
+
+def seed_database(conn, scale, seed=0, recommendations=False):
+    """Fill an empty, migrated database with synthetic rows; returns seconds per table."""
+    import ratings
+    import search
+    import stats
+    import validator
+    import versions
+    from db import transaction
+
+    # Derived data is rebuilt once at the end instead of by triggers per row
+    triggers = (list(search.FTS_TRIGGERS) + list(ratings.RATINGS_TRIGGERS) + list(stats.STATS_TRIGGERS) +
+                list(versions.VERSION_TRIGGERS))
+    with transaction(conn):
+        for trigger_name in triggers:
+            conn.execute(f'DROP TRIGGER IF EXISTS {trigger_name};')
+
+    params = {'words': json.dumps(WORDS), 'statuses': json.dumps(STATUSES),
+              'password': validator.hash_password(BENCH_PASSWORD)}
+    timings = {}
+    for table, insert_query in seed_queries(scale, seed):
+        started = time.perf_counter()
+        with transaction(conn):
+            conn.execute(insert_query, {name: value for name, value in params.items() if f':{name}' in insert_query})
+        timings[table] = round(time.perf_counter() - started, 3)
+        print(f'Seeded {table} in {timings[table]}s')
+
+    started = time.perf_counter()
+    with transaction(conn):
+        search.create_search_index(conn)
+        search.rebuild_search_index(conn)
+        ratings.create_product_ratings(conn)
+        stats.create_store_stats(conn)
+        versions.create_versions(conn)
+    timings['derived'] = round(time.perf_counter() - started, 3)
+
+    if recommendations:
+        import recommender
+        timings['recommendations'] = recommender.build_recommendations(conn)['seconds']
+
+    conn.execute('ANALYZE;')
+    return timings
+
+
+# Scenarios: each call returns the (label, method, path, form) steps of one iteration
+
+def products_scenario(rng, scale, user_id):
+    params = {'sort_by': rng.choice(SORTS)}
+    if rng.random() < 0.5:
+        params['category'] = rng.randint(1, scale['categories'])
+    if rng.random() < 0.3:
+        low = rng.randint(1, 1500)
+        params['price_range'] = f'{low}-{low + rng.randint(10, 500)}'
+    return [('GET /products', 'GET', '/products?' + urlencode(params), None)]
+
+
+def search_scenario(rng, scale, user_id):
+    words = ' '.join(rng.sample(WORDS, rng.randint(1, 2)))
+    return [('GET /products?search_query', 'GET', '/products?' + urlencode({'search_query': words}), None)]
+
+
+def product_detail_scenario(rng, scale, user_id):
+    return [('GET /products/<id>', 'GET', f'/products/{rng.randint(1, scale["products"])}', None)]
+
+
+def dashboard_scenario(rng, scale, user_id):
+    return [('GET /dashboard', 'GET', '/dashboard', None)]
+
+
+def login_scenario(rng, scale, user_id):
+    username = f'user{rng.randint(1, scale["users"])}'
+    return [('POST /login', 'POST', '/login', {'username': username, 'password': BENCH_PASSWORD})]
+
+
+def checkout_scenario(rng, scale, user_id):
+    # Every worker buys from the same few products, so checkouts contend on stock rows
+    product_id = rng.randint(1, min(HOT_PRODUCTS, scale['products']))
+    return [
+        ('POST /add_to_cart', 'POST', '/add_to_cart', {'product_id': product_id, 'quantity': 1}),
+        ('POST /checkout', 'POST', '/checkout', {}),
+    ]
+
+
+SCENARIOS = {
+    'products': products_scenario,
+    'search': search_scenario,
+    'product_detail': product_detail_scenario,
+    'dashboard': dashboard_scenario,
+    'login': login_scenario,
+    'checkout': checkout_scenario,
+}
+
+
+def _client_address(worker):
+    # One loopback address per worker, so per-client limits see distinct clients
+    return f'127.0.{worker // 250}.{worker % 250 + 2}'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # Access logging would cost more than some of the requests it reports
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+class TestClientSession:
+    def __init__(self, app, worker):
+        self.client = app.test_client()
+        self.environ = {'REMOTE_ADDR': _client_address(worker)}
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data, environ_base=self.environ).status_code
+
+    def close(self):
+        pass
+
+
+class HTTPSession:
+    def __init__(self, host, port, worker):
+        self.conn = http.client.HTTPConnection(host, port, timeout=60, source_address=(_client_address(worker), 0))
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            return None
+        for header in response.headers.get_all('Set-Cookie') or ():
+            name, _, rest = header.partition('=')
+            self.cookies[name] = rest.split(';', 1)[0]
+        return response.status
+
+    def close(self):
+        self.conn.close()
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(latencies, statuses, seconds):
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status is None or status >= 500)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        'throughput_rps': round(len(latencies) / seconds, 1) if seconds else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+def run_scenario(sessions, scenario, scale, iterations, warmup=0, seed=0):
+    """Run a scenario from every session in parallel; returns per-step summaries."""
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+    start = threading.Barrier(len(sessions) + 1)
+
+    def worker(index, session):
+        rng = random.Random(seed * 1000 + index)
+        user_id = index % scale['users'] + 1
+        own_latencies = defaultdict(list)
+        own_statuses = defaultdict(Counter)
+
+        for _ in range(warmup):
+            for _, method, path, data in scenario(rng, scale, user_id):
+                session.request(method, path, data)
+
+        start.wait()
+        share = iterations // len(sessions) + (1 if index < iterations % len(sessions) else 0)
+        for _ in range(share):
+            for label, method, path, data in scenario(rng, scale, user_id):
+                started = time.perf_counter()
+                status = session.request(method, path, data)
+                own_latencies[label].append(time.perf_counter() - started)
+                own_statuses[label][status] += 1
+
+        with lock:
+            for label, values in own_latencies.items():
+                latencies[label].extend(values)
+                statuses[label].update(own_statuses[label])
+
+    threads = [threading.Thread(target=worker, args=(index, session), daemon=True)
+               for index, session in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    return {label: summarize(latencies[label], statuses[label], seconds) for label in latencies}
+
+
+def compare(report, baseline, tolerance=0.10):
+    """Compare endpoint results against a baseline report.
+
+    An endpoint regresses when its p95 is more than ``tolerance`` slower or
+    its throughput more than ``tolerance`` lower than in the baseline.
+    """
+    comparison = {}
+    for label, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(label)
+        if not previous:
+            continue
+        entry = {}
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            if current.get(key) and previous.get(key):
+                entry[f'{key}_change'] = round(current[key] / previous[key] - 1, 4)
+        entry['regression'] = (entry.get('p95_ms_change', 0) > tolerance or
+                               entry.get('throughput_rps_change', 0) < -tolerance)
+        comparison[label] = entry
+    return comparison
+
+
+def prepare_app(database, cache_enabled=True):
+    import routes
+    import cache
+    import db
+    import migrations
+
+    app = routes.app
+    app.config['DATABASE'] = database
+    db.configure(database)
+    migrations.ensure_schema()
+    if not cache_enabled:
+        cache.configure_catalog_cache(max_entries=0)
+
+    # Fill in only the templates the app does not have
+    missing = {}
+    for name, source in FALLBACK_TEMPLATES.items():
+        try:
+            app.jinja_loader.get_source(app.jinja_env, name)
+        except Exception:
+            missing[name] = source
+    if missing:
+        app.jinja_loader = ChoiceLoader([app.jinja_loader, DictLoader(missing)])
+        app.jinja_env.loader = app.create_global_jinja_loader()
+    return app, sorted(missing)
+
+
+def run(database, scale, scenarios, mode='client', concurrency=8, iterations=200, warmup=5, seed=0,
+        cache_enabled=True):
+    import db
+
+    app, fallback_templates = prepare_app(database, cache_enabled)
+
+    server = None
+    if mode == 'http':
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+
+    def make_session(worker):
+        if server is not None:
+            return HTTPSession('127.0.0.1', server.server_port, worker)
+        return TestClientSession(app, worker)
+
+    endpoints = {}
+    try:
+        for name in scenarios:
+            sessions = [make_session(worker) for worker in range(concurrency)]
+            for index, session in enumerate(sessions):
+                session.request('POST', '/login', {'username': f'user{index % scale["users"] + 1}',
+                                                   'password': BENCH_PASSWORD})
+            print(f'Running {name}: {iterations} iterations, {concurrency} workers')
+            endpoints.update(run_scenario(sessions, SCENARIOS[name], scale, iterations, warmup, seed))
+            for session in sessions:
+                session.close()
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    return {
+        'meta': {
+            'mode': mode,
+            'concurrency': concurrency,
+            'iterations': iterations,
+            'scale': scale,
+            'seed': seed,
+            'cache': cache_enabled,
+            'fallback_templates': fallback_templates,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'endpoints': endpoints,
+        'pool': db.pool_stats(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed a synthetic database and load test the backend routes.')
+    parser.add_argument('--database', help='database file (default: a temporary file)')
+    parser.add_argument('--reuse', action='store_true', help='skip seeding if the database already exists')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for table in SCALES['small']:
+        parser.add_argument(f'--{table}', type=int, help=f'override the number of {table}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--recommendations', action='store_true', help='build product_neighbors (needs numpy/scipy)')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client',
+                        help='Flask test client in-process, or a threaded local HTTP server')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=200, help='iterations per scenario across all workers')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed iterations per worker')
+    parser.add_argument('--no-cache', action='store_true', help='disable the catalog cache')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='compare against a previous JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    scale = dict(SCALES[args.scale])
+    for table in scale:
+        if getattr(args, table) is not None:
+            scale[table] = getattr(args, table)
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+
+    directory = None
+    database = args.database
+    if database is None:
+        directory = tempfile.TemporaryDirectory()
+        database = os.path.join(directory.name, 'bench.db')
+
+    seed_seconds = None
+    if not (args.reuse and os.path.exists(database)):
+        from db import ConnectionPool
+        from migrations import migrate
+
+        pool = ConnectionPool(database, size=1)
+        with pool.connection() as conn:
+            migrate(conn)
+            seed_seconds = seed_database(conn, scale, args.seed, args.recommendations)
+        pool.close()
+
+    report = run(database, scale, scenarios, mode=args.mode, concurrency=args.concurrency,
+                 iterations=args.iterations, warmup=args.warmup, seed=args.seed, cache_enabled=not args.no_cache)
+    report['seed_seconds'] = seed_seconds
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(report, json.load(f), args.tolerance)
+        regressed = any(entry['regression'] for entry in report['comparison'].values())
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    import writebehind
+    writebehind.view_queue.stop()
+    if directory is not None:
+        directory.cleanup()
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
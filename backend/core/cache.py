@@ -0,0 +1,173 @@
+import functools
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+@functools.lru_cache(maxsize=None)
+def _slot_names(cls):
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend((slots,) if isinstance(slots, str) else slots)
+    return tuple(names)
+
+
+def approximate_size(value, _seen=None):
+    # Rough deep size of the plain containers, __slots__ rows and scalars
+    # cached values are made of
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(k, _seen) + approximate_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, _seen) for item in value)
+    else:
+        size += sum(approximate_size(getattr(value, name, None), _seen) for name in _slot_names(type(value)))
+    return size
+
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry TTL and an approximate memory bound.
+
+    Keys are grouped by their first element (``('products', ...)``) so a
+    whole group can be invalidated in O(1) by bumping its generation; stale
+    generations are never returned and age out through normal LRU eviction.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, default_ttl=60.0, sizeof=approximate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.sizeof = sizeof
+
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._generations = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _key(self, key):
+        return (self._generations.get(key[0], 0),) + key
+
+    def _drop(self, full_key):
+        _, size, _ = self._entries.pop(full_key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            full_key = self._key(key)
+            entry = self._entries.get(full_key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            if entry[0] <= time.monotonic():
+                self._drop(full_key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._entries.move_to_end(full_key)
+            self._stats['hits'] += 1
+            return entry[2]
+
+    def set(self, key, value, ttl=None):
+        size = self.sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+
+        with self._lock:
+            full_key = self._key(key)
+            if full_key in self._entries:
+                self._drop(full_key)
+            self._entries[full_key] = (expires_at, size, value)
+            self._bytes += size
+
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_bytes and self._bytes > self.max_bytes)):
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats['evictions'] += 1
+
+    def get_or_load(self, key, loader, ttl=None):
+        # Read-through: a None result is treated as a failed load and not cached
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, group, *key):
+        with self._lock:
+            self._stats['invalidations'] += 1
+            if key:
+                full_key = self._key((group,) + key)
+                if full_key in self._entries:
+                    self._drop(full_key)
+            else:
+                self._generations[group] = self._generations.get(group, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        return stats
+
+
+# Storefront catalog reads: category list, product listing pages and product details
+CATEGORIES_TTL = 300.0
+PRODUCTS_TTL = 30.0
+
+catalog_cache = TTLCache(default_ttl=PRODUCTS_TTL)
+
+
+def configure_catalog_cache(**options):
+    global catalog_cache
+    catalog_cache = TTLCache(**options)
+    return catalog_cache
+
+
+def invalidate_categories():
+    catalog_cache.invalidate('categories')
+
+
+def invalidate_products(*product_ids):
+    # Any product write can move a product between listing pages, so
+    # listings are always dropped; details only for the products written,
+    # or all of them when none are named.
+    catalog_cache.invalidate('products')
+    if not product_ids:
+        catalog_cache.invalidate('product')
+    for product_id in product_ids:
+        catalog_cache.invalidate('product', product_id)
+
+
+# Flask-Login identities: user id -> id, short-lived so deleted users drop out quickly
+IDENTITY_TTL = 60.0
+
+identity_cache = TTLCache(max_entries=10000, max_bytes=None, default_ttl=IDENTITY_TTL)
+
+
+def configure_identity_cache(**options):
+    global identity_cache
+    identity_cache = TTLCache(**options)
+    return identity_cache
+
+
+def invalidate_user(user_id):
+    identity_cache.invalidate('user', int(user_id))
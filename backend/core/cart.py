@@ -0,0 +1,98 @@
+from db import transaction
+import holds
+
+MAX_CART_ITEMS = 500
+
+ADD_ITEM_QUERY = '''
+    INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+'''
+
+SET_ITEM_QUERY = '''
+    INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, ?)
+    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = excluded.quantity;
+'''
+
+REMOVE_ITEM_QUERY = '''
+    DELETE FROM carts WHERE user_id = ? AND product_id = ?;
+'''
+
+
+class CartError(ValueError):
+    pass
+
+
+def _is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_item(product_id, quantity):
+    # A single add: both must be integers and at least one unit is added
+    try:
+        product_id = int(product_id)
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        raise CartError('product_id and quantity must be integers')
+    if quantity < 1:
+        raise CartError('quantity must be at least 1')
+    return product_id, quantity
+
+
+def parse_items(items):
+    if not isinstance(items, list) or not items:
+        raise CartError('items must be a non-empty list')
+    if len(items) > MAX_CART_ITEMS:
+        raise CartError(f'At most {MAX_CART_ITEMS} items can be sent at once')
+
+    # Repeated products in one batch are merged before touching the table.
+    # JSON numbers are taken as they are: 1.9 or true is not a quantity.
+    merged = {}
+    for item in items:
+        try:
+            product_id = item['product_id']
+            quantity = item['quantity']
+        except (KeyError, TypeError):
+            raise CartError('Each item needs an integer product_id and quantity')
+        if not (_is_integer(product_id) and _is_integer(quantity)):
+            raise CartError('Each item needs an integer product_id and quantity')
+        merged[product_id] = merged.get(product_id, 0) + quantity
+
+    return merged
+
+
+def add_item(conn, user_id, product_id, quantity, hold_ttl=holds.HOLD_TTL):
+    # Adding a product already in the cart increases its quantity and its hold
+    product_id, quantity = parse_item(product_id, quantity)
+    with transaction(conn):
+        conn.execute(ADD_ITEM_QUERY, (user_id, product_id, quantity))
+        holds.hold_cart_lines(conn, user_id, [product_id], hold_ttl)
+
+
+def upsert_cart_items(conn, user_id, items, replace=False, hold_ttl=holds.HOLD_TTL):
+    """Apply many cart lines for one user in a single transaction.
+
+    By default quantities are added to what is already in the cart. With
+    ``replace`` they overwrite it and a quantity of zero or less removes
+    the product. Stock is held for every changed line; if any of them is
+    short, holds.InsufficientStockError is raised and nothing changes.
+    """
+    if replace:
+        upserts = [(user_id, product_id, quantity) for product_id, quantity in items.items() if quantity > 0]
+        removals = [(user_id, product_id) for product_id, quantity in items.items() if quantity <= 0]
+    else:
+        if any(quantity <= 0 for quantity in items.values()):
+            raise CartError('Quantities must be positive')
+        upserts = [(user_id, product_id, quantity) for product_id, quantity in items.items()]
+        removals = []
+
+    with transaction(conn):
+        cursor = conn.cursor()
+        if upserts:
+            cursor.executemany(SET_ITEM_QUERY if replace else ADD_ITEM_QUERY, upserts)
+        if removals:
+            cursor.executemany(REMOVE_ITEM_QUERY, removals)
+            holds.release_holds(conn, user_id, [product_id for _, product_id in removals])
+        if upserts:
+            holds.hold_cart_lines(conn, user_id, [product_id for _, product_id, _ in upserts], hold_ttl)
+
+    return len(upserts), len(removals)
@@ -0,0 +1,166 @@
+import search
+import pagination
+from rows import ProductRow
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+# Every product column except the search-only snippet
+PRODUCT_COLUMNS = ProductRow._fields[:-1]
+
+# Whitelisted sort keys: name -> (expression, direction). The primary key is
+# always the tiebreaker so every ordering is total and can be resumed.
+SORT_KEYS = {
+    'newest': ('products.date_added', 'DESC'),
+    'oldest': ('products.date_added', 'ASC'),
+    'price_asc': ('products.price', 'ASC'),
+    'price_desc': ('products.price', 'DESC'),
+    'rating': ('products.avg_rating', 'DESC'),
+    # Scores and sorts every match; see search.RANK_FUNCTION
+    'relevance': (search.RANK_EXPRESSION, 'ASC'),
+}
+DEFAULT_SORT = 'newest'
+
+# JSON types a cursor's sort value may have for each sort key: timestamps
+# are text, prices, ratings and bm25 scores are numbers
+NUMBER = (int, float)
+SORT_VALUE_TYPES = {
+    'newest': str,
+    'oldest': str,
+    'price_asc': NUMBER,
+    'price_desc': NUMBER,
+    'rating': NUMBER,
+    'relevance': NUMBER,
+}
+DEFAULT_SEARCH_SORT = 'relevance'
+
+# Supporting indexes for the filters and sort keys above. The category
+# filter has a matching index for every sort key, so a filtered page is an
+# index walk just like an unfiltered one. Price and rating ranges are only
+# bounded by an index when sorting on the same column; under any other sort
+# the rows in range are sorted first, so that cost grows with the range.
+CATALOG_INDEXES = {
+    'idx_products_category_price': ('products', 'category_id, price'),
+    'idx_products_category_date_added': ('products', 'category_id, date_added, id'),
+    'idx_products_date_added': ('products', 'date_added'),
+    'idx_products_price': ('products', 'price'),
+}
+
+# Built on products.avg_rating, so created after the rating summaries migration
+RATING_INDEXES = {
+    'idx_products_category_avg_rating': ('products', 'category_id, avg_rating, id'),
+}
+
+
+class CatalogQueryError(ValueError):
+    pass
+
+
+def encode_cursor(sort_by, sort_value, last_id):
+    return pagination.encode_cursor([sort_by, sort_value, last_id])
+
+
+def decode_cursor(sort_by, cursor):
+    try:
+        cursor_sort, value, last_id = pagination.decode_cursor(cursor)
+    except ValueError:
+        raise CatalogQueryError('Invalid cursor')
+
+    if cursor_sort != sort_by:
+        raise CatalogQueryError('Cursor does not match the requested sort order')
+
+    # Only scalars of the sort column's kind are ever bound into the query
+    if (isinstance(value, bool) or not isinstance(value, SORT_VALUE_TYPES[sort_by])
+            or type(last_id) is not int):
+        raise CatalogQueryError('Invalid cursor')
+
+    return value, last_id
+
+
+def parse_price_range(price_range):
+    # Accepts "min-max", "min-" or "-max"
+    if not price_range:
+        return None, None
+    try:
+        low, _, high = price_range.partition('-')
+        return (float(low) if low else None), (float(high) if high else None)
+    except ValueError:
+        raise CatalogQueryError(f'Invalid price range: {price_range}')
+
+
+def build_product_query(category_id=None, min_price=None, max_price=None, min_rating=None, search_query=None,
+                        sort_by=None, cursor=None, limit=DEFAULT_PAGE_SIZE, snippets=False):
+    match_query = search.to_match_query(search_query)
+
+    sort_by = sort_by or (DEFAULT_SEARCH_SORT if match_query else DEFAULT_SORT)
+    if sort_by not in SORT_KEYS:
+        raise CatalogQueryError(f'Unsupported sort key: {sort_by}')
+    if sort_by == 'relevance' and not match_query:
+        raise CatalogQueryError('Sorting by relevance requires a search query')
+    sort_expression, direction = SORT_KEYS[sort_by]
+
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    columns = [f'products.{column}' for column in PRODUCT_COLUMNS]
+    source = 'products'
+    filters = []
+    params = []
+
+    if match_query:
+        source += f' JOIN {search.FTS_TABLE} ON {search.FTS_TABLE}.rowid = products.id'
+        filters.append(f'{search.FTS_TABLE} MATCH ?')
+        params.append(match_query)
+        if snippets:
+            columns.append(search.SNIPPET_EXPRESSION)
+    if category_id is not None:
+        filters.append('products.category_id = ?')
+        params.append(int(category_id))
+    if min_price is not None:
+        filters.append('products.price >= ?')
+        params.append(min_price)
+    if max_price is not None:
+        filters.append('products.price <= ?')
+        params.append(max_price)
+    if min_rating is not None:
+        filters.append('products.avg_rating >= ?')
+        params.append(min_rating)
+
+    # Keyset pagination: resume strictly after the last row of the previous page
+    if cursor:
+        value, last_id = decode_cursor(sort_by, cursor)
+        comparison = '<' if direction == 'DESC' else '>'
+        filters.append(f'({sort_expression}, products.id) {comparison} (?, ?)')
+        params.extend([value, last_id])
+
+    # The sort value rides along as a trailing column so the next cursor can be built
+    columns.append(sort_expression)
+
+    select_query = f'SELECT {", ".join(columns)} FROM {source}'
+    if filters:
+        select_query += ' WHERE ' + ' AND '.join(filters)
+    select_query += f' ORDER BY {sort_expression} {direction}, products.id {direction} LIMIT ?'
+
+    # Fetch one extra row to know whether another page exists
+    params.append(limit + 1)
+
+    return select_query, params, sort_by, limit
+
+
+def query_products(conn, **options):
+    select_query, params, sort_by, limit = build_product_query(**options)
+
+    cursor = conn.cursor()
+    cursor.execute(select_query, params)
+    rows = cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort_by, rows[-1][-1], rows[-1][0])
+
+    return [ProductRow(*row[:-1]) for row in rows], next_cursor
+
+
+def get_product(conn, product_id):
+    select_query = f'SELECT {", ".join(PRODUCT_COLUMNS)} FROM products WHERE id = ?;'
+    return ProductRow.select(conn, select_query, (product_id,)).fetchone()
@@ -0,0 +1,105 @@
+from db import transaction
+from sessions import timestamp
+import cache
+import holds
+
+# Stock held by other carts is not available to this one; the user's own
+# holds, live or expired, are what this checkout is about to consume
+CART_LINES_QUERY = '''
+    SELECT c.product_id, c.quantity, p.price, p.stock_quantity - (
+        SELECT COALESCE(SUM(h.quantity), 0) FROM stock_holds h
+        WHERE h.product_id = c.product_id AND h.expires_at > ? AND h.user_id != c.user_id
+    )
+    FROM carts c
+    LEFT JOIN products p ON p.id = c.product_id
+    WHERE c.user_id = ?
+    ORDER BY c.product_id;
+'''
+
+RESERVE_STOCK_QUERY = '''
+    UPDATE products SET stock_quantity = stock_quantity - ?
+    WHERE id = ? AND stock_quantity >= ?;
+'''
+
+INSERT_ORDER_QUERY = '''
+    INSERT INTO orders (user_id, total_price, status) VALUES (?, ?, 'pending');
+'''
+
+INSERT_ORDER_ITEM_QUERY = '''
+    INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?);
+'''
+
+CLEAR_CART_QUERY = '''
+    DELETE FROM carts WHERE user_id = ?;
+'''
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCartError(CheckoutError):
+    pass
+
+
+class InvalidCartError(CheckoutError):
+    def __init__(self, product_ids):
+        super().__init__(f'Invalid cart quantity for products: {", ".join(map(str, product_ids))}')
+        self.product_ids = product_ids
+
+
+class OutOfStockError(CheckoutError):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock for products: {", ".join(map(str, product_ids))}')
+        self.product_ids = product_ids
+
+
+def checkout(conn, user_id):
+    """Turn the user's cart into a pending order.
+
+    Everything runs in one BEGIN IMMEDIATE transaction: the cart and prices
+    are read, stock is decremented, the order and its lines are written and
+    the cart is cleared, or nothing is. Holding the write lock from the
+    start means the stock read here cannot go stale before the update.
+    Stock held by other carts is left alone and the user's holds are
+    released with the cart.
+    """
+    with transaction(conn):
+        cursor = conn.cursor()
+
+        cursor.execute(CART_LINES_QUERY, (timestamp(), user_id))
+        lines = cursor.fetchall()
+        if not lines:
+            raise EmptyCartError('Cart is empty')
+
+        # A zero or negative line would credit stock and order totals
+        invalid = [product_id for product_id, quantity, _, _ in lines
+                   if not isinstance(quantity, int) or quantity <= 0]
+        if invalid:
+            raise InvalidCartError(invalid)
+
+        unavailable = [product_id for product_id, quantity, price, available in lines
+                       if price is None or available < quantity]
+        if unavailable:
+            raise OutOfStockError(unavailable)
+
+        total_price = sum(quantity * price for _, quantity, price, _ in lines)
+
+        # The stock guard in the WHERE clause stays as a second line of defence
+        cursor.executemany(RESERVE_STOCK_QUERY, [(quantity, product_id, quantity)
+                                                 for product_id, quantity, _, _ in lines])
+        if cursor.rowcount != len(lines):
+            raise OutOfStockError([product_id for product_id, _, _, _ in lines])
+
+        cursor.execute(INSERT_ORDER_QUERY, (user_id, total_price))
+        order_id = cursor.lastrowid
+
+        cursor.executemany(INSERT_ORDER_ITEM_QUERY, [(order_id, product_id, quantity, price)
+                                                     for product_id, quantity, price, _ in lines])
+        cursor.execute(CLEAR_CART_QUERY, (user_id,))
+        holds.release_holds(conn, user_id)
+
+    # Stock levels changed, so cached listings and details are stale
+    cache.invalidate_products(*[product_id for product_id, _, _, _ in lines])
+
+    return order_id, total_price
@@ -0,0 +1,167 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from db import get_db
+from rows import UserRow, OrderRow
+
+RECENT_LIMIT = 5
+HISTORY_ORDERS = 10
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='dashboard')
+
+
+# User row, order statistics and recent orders in a single statement.
+# SUM and COUNT share one pass over the user's orders.
+def get_user_summary(conn, user_id):
+    cursor = conn.cursor()
+
+    user_columns = ', '.join(f'u.{column}' for column in UserRow._fields)
+    order_columns = ', '.join(f'r.{column}' for column in OrderRow._fields)
+
+    select_query = f'''
+    WITH stats AS (
+        SELECT COALESCE(SUM(total_price), 0) AS total_spending,
+               COUNT(*) AS total_orders
+        FROM orders
+        WHERE user_id = ?
+    ),
+    recent_orders AS (
+        SELECT {OrderRow.columns} FROM orders
+        WHERE user_id = ?
+        ORDER BY order_date DESC
+        LIMIT ?
+    )
+    SELECT {user_columns}, s.total_spending, s.total_orders, {order_columns}
+    FROM users u
+    CROSS JOIN stats s
+    LEFT JOIN recent_orders r ON 1
+    WHERE u.id = ?
+    ORDER BY r.order_date DESC;
+    '''
+
+    cursor.execute(select_query, (user_id, user_id, RECENT_LIMIT, user_id))
+    rows = cursor.fetchall()
+    if not rows:
+        return None, [], None
+
+    split = len(UserRow._fields)
+
+    user = UserRow(*rows[0][:split])
+    total_spending, total_orders = rows[0][split:split + 2]
+    recent_orders = [OrderRow(*row[split + 2:]) for row in rows if row[split + 2] is not None]
+
+    user_statistics = {
+        'total_spending': total_spending,
+        'total_orders': total_orders,
+    }
+
+    return user, recent_orders, user_statistics
+
+
+def get_recent_product_views(conn, user_id):
+    cursor = conn.cursor()
+
+    select_query = '''
+    SELECT p.name
+    FROM product_views v
+    JOIN products p ON p.id = v.product_id
+    WHERE v.user_id = ?
+    ORDER BY v.view_date DESC
+    LIMIT ?;
+    '''
+
+    cursor.execute(select_query, (user_id, RECENT_LIMIT))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_recent_forum_posts(conn, user_id):
+    cursor = conn.cursor()
+
+    select_query = '''
+    SELECT post_content FROM forum_posts
+    WHERE user_id = ?
+    ORDER BY post_date DESC
+    LIMIT ?;
+    '''
+
+    cursor.execute(select_query, (user_id, RECENT_LIMIT))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_personalized_recommendations(conn, user_id):
+    cursor = conn.cursor()
+
+    # Neighbours of the products in the user's recent orders, from the
+    # precomputed co-purchase table, excluding what they already bought
+    select_query = '''
+    WITH recent_orders AS (
+        SELECT id FROM orders
+        WHERE user_id = ?
+        ORDER BY order_date DESC
+        LIMIT ?
+    ),
+    history AS (
+        SELECT DISTINCT oi.product_id
+        FROM recent_orders o
+        JOIN order_items oi ON oi.order_id = o.id
+    )
+    SELECT p.name
+    FROM product_neighbors n
+    JOIN products p ON p.id = n.neighbor_id
+    WHERE n.product_id IN history
+      AND n.neighbor_id NOT IN history
+    GROUP BY n.neighbor_id
+    ORDER BY SUM(n.score) DESC, n.neighbor_id
+    LIMIT ?;
+    '''
+
+    cursor.execute(select_query, (user_id, HISTORY_ORDERS, RECENT_LIMIT))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Panel name -> (loader, error message prefix)
+PANELS = {
+    'summary': (get_user_summary, 'Error fetching user details'),
+    'recent_views': (get_recent_product_views, 'Error fetching recent product views'),
+    'recent_posts': (get_recent_forum_posts, 'Error fetching recent forum posts'),
+    'recommendations': (get_personalized_recommendations, 'Error generating personalized recommendations'),
+}
+
+
+def _load_panel(name, user_id):
+    loader, message = PANELS[name]
+    try:
+        with get_db() as conn:
+            return loader(conn, user_id), None
+    except sqlite3.Error as e:
+        return None, f'{message}: {e}'
+
+
+def load_dashboard(user_id, concurrent=False):
+    """Load every dashboard panel for a user.
+
+    Panels run on one shared connection, or in parallel on pooled
+    connections when ``concurrent`` is set. A failing panel does not
+    stop the others; its error message is returned instead of raised
+    so the caller can flash it from the request thread.
+    """
+    if concurrent:
+        futures = {name: _executor.submit(_load_panel, name, user_id) for name in PANELS}
+        results = {name: future.result() for name, future in futures.items()}
+    else:
+        with get_db():
+            results = {name: _load_panel(name, user_id) for name in PANELS}
+
+    errors = [error for _, error in results.values() if error]
+
+    user, recent_orders, user_statistics = results['summary'][0] or (None, None, None)
+
+    data = {
+        'user': user,
+        'recent_orders': recent_orders,
+        'recent_views': results['recent_views'][0],
+        'recent_posts': results['recent_posts'][0],
+        'recommendations': results['recommendations'][0],
+        'user_statistics': user_statistics,
+    }
+
+    return data, errors
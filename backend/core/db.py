@@ -0,0 +1,393 @@
+import sqlite3
+import contextlib
+import functools
+import os
+import random
+import threading
+import queue
+import time
+
+DATABASE = 'site.db'
+
+# Pool and connection tuning
+POOL_SIZE = 8
+POOL_TIMEOUT = 30.0
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,  # negative means KiB, so ~16 MB per connection
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+# Write retries once busy_timeout is exhausted, or when a WAL read snapshot
+# went stale before the write (SQLITE_BUSY_SNAPSHOT skips the busy handler)
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.02
+
+# Snapshot replicas for catalog reads; off unless an interval is configured
+REPLICA_PRAGMAS = {
+    'query_only': 'ON',
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    pass
+
+
+class DatabaseBusy(sqlite3.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT, pragmas=None,
+                 factory=sqlite3.Connection, on_connect=None):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self.factory = factory
+        self.on_connect = on_connect
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = []
+        self._closed = False
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'checked_out': 0,
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.pragmas.get('busy_timeout', 5000) / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            factory=self.factory,
+        )
+        # One script, so connection setup is not reported as query traffic
+        conn.executescript(''.join(f'PRAGMA {name} = {value};' for name, value in self.pragmas.items()))
+        if self.on_connect is not None:
+            self.on_connect(conn)
+        return conn
+
+    def _bump(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            self._bump('waits')
+            started = time.perf_counter()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            self._bump('wait_seconds', time.perf_counter() - started)
+            if not acquired:
+                self._bump('timeouts')
+                raise PoolTimeout(f'Timed out waiting for a connection to {self.database}')
+
+        try:
+            conn = self._idle.get_nowait()
+            self._bump('hits')
+        except queue.Empty:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+            with self._lock:
+                self._all.append(conn)
+            self._bump('misses')
+
+        self._bump('checked_out')
+        return conn
+
+    def _release(self, conn):
+        try:
+            # Never hand a half-finished transaction to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+            # A connection checked out while its pool was closed (a retired
+            # replica snapshot) is closed on return instead of kept idle
+            with self._lock:
+                discard = self._closed
+                if not discard:
+                    self._idle.put(conn)
+        except sqlite3.Error:
+            discard = True
+        finally:
+            self._bump('checked_out', -1)
+            self._slots.release()
+        if discard:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+        conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        # Nested get_db() calls on the same thread share the connection
+        # already checked out instead of taking a second slot.
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._bump('hits')
+            yield held
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    def copy(self):
+        # An empty pool with the same settings
+        return ConnectionPool(self.database, self.size, self.timeout, self.pragmas, self.factory, self.on_connect)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open'] = len(self._all)
+        stats['idle'] = self._idle.qsize()
+        stats['size'] = self.size
+        return stats
+
+    def close(self):
+        # Idle connections close now, checked-out ones as they are released
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(database=None, **options):
+    global DATABASE, _pool
+    with _pool_lock:
+        if database is not None:
+            DATABASE = database
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(DATABASE, **options)
+    return _pool
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DATABASE)
+    return _pool
+
+
+def get_db():
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def is_busy(error):
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is None:
+        return 'database is locked' in str(error)
+    return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def retry_on_busy(func=None, attempts=BUSY_RETRIES, backoff=BUSY_BACKOFF):
+    """Re-run ``func`` with jittered exponential backoff while SQLite reports busy.
+
+    The wrapped function must take its own connection and transaction, so a
+    retry starts from scratch; the last busy error is raised as DatabaseBusy.
+    """
+    if func is None:
+        return functools.partial(retry_on_busy, attempts=attempts, backoff=backoff)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if isinstance(e, PoolTimeout) or not is_busy(e):
+                    raise
+                if attempt == attempts - 1:
+                    raise DatabaseBusy(str(e)) from e
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    return wrapper
+
+
+class SnapshotReplica:
+    """Periodically refreshed read-only copy of the database.
+
+    Each refresh copies the primary with the backup API into a new file and
+    swaps in a pool for it; the previous snapshot is deleted one refresh
+    later so requests still reading it can finish. Readers never hold the
+    primary's WAL open, at the cost of seeing data up to ``interval`` old.
+    """
+
+    def __init__(self, database, interval, size=POOL_SIZE):
+        self.database = database
+        self.interval = interval
+        self.size = size
+        self.pool = None
+        self.generation = 0
+        self._paths = []
+        self._stop = threading.Event()
+
+    def refresh(self):
+        self.generation += 1
+        path = f'{self.database}.snapshot-{os.getpid()}-{self.generation}'
+        target = sqlite3.connect(path)
+        try:
+            with get_db() as source:
+                source.backup(target)
+            target.execute('PRAGMA journal_mode = DELETE;')
+        finally:
+            target.close()
+
+        previous = self.pool
+        self.pool = ConnectionPool(path, size=self.size, pragmas=REPLICA_PRAGMAS)
+        self._paths.append(path)
+        if previous is not None:
+            previous.close()
+        while len(self._paths) > 2:
+            with contextlib.suppress(OSError):
+                os.remove(self._paths.pop(0))
+
+    def start(self):
+        self.refresh()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.refresh()
+                except sqlite3.Error as e:
+                    print("Error refreshing database snapshot:", e)
+
+        threading.Thread(target=run, name='snapshot-replica', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self.pool is not None:
+            self.pool.close()
+        for path in self._paths:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+        self._paths = []
+
+
+_replica = None
+
+
+def configure_replica(interval=None, size=POOL_SIZE):
+    global _replica
+    if _replica is not None:
+        _replica.stop()
+        _replica = None
+    if interval:
+        _replica = SnapshotReplica(DATABASE, interval, size)
+        _replica.start()
+    return _replica
+
+
+def get_read_db():
+    # For reads that already tolerate staleness, like the cached catalog
+    replica = _replica
+    if replica is None or replica.pool is None:
+        return get_db()
+    return replica.pool.connection()
+
+
+# Pools that existed when this process was forked. Their connections share
+# file locks with the parent, and closing them here would release the
+# parent's locks, so they are kept referenced and never used again.
+_inherited = []
+
+
+def _reset_after_fork():
+    global _pool, _pool_lock, _replica
+    _pool_lock = threading.Lock()
+    if _replica is not None:
+        _inherited.append(_replica.pool)
+        _replica = None
+    if _pool is not None:
+        _inherited.append(_pool)
+        _pool = _pool.copy()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextlib.contextmanager
+def transaction(conn, mode='IMMEDIATE'):
+    # BEGIN IMMEDIATE takes the write lock up front, so a read-then-write
+    # transaction cannot fail half way with SQLITE_BUSY on lock upgrade.
+    conn.execute(f'BEGIN {mode};')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+def delete_in_batches(conn, query, params, batch_size, pause):
+    """Repeat a DELETE ... LIMIT ? until a batch comes back short; returns the rows deleted.
+
+    ``query`` takes ``params`` followed by the batch size. Each batch is its
+    own short write transaction, so requests waiting on the write lock only
+    ever wait for one batch.
+    """
+    deleted = 0
+    while True:
+        with transaction(conn):
+            count = conn.execute(query, (*params, batch_size)).rowcount
+        deleted += count
+        if count < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def start_sweeper(name, sweep, interval, batch_size):
+    # Calls sweep(conn, batch_size) every interval seconds; set the returned event to stop
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                with get_db() as conn:
+                    sweep(conn, batch_size)
+            except Exception as e:
+                print(f"Error in {name}:", e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return stop
@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from rows import OrderRow, PaymentRow, UserRow
+
+BATCH_SIZE = 1000
+
+# Exportable tables: row columns (password hashes are never exported) and
+# the timestamp column used for date-range filters.
+EXPORTS = {
+    'orders': (OrderRow._fields, 'order_date'),
+    'payments': (PaymentRow._fields, 'date_added'),
+    'users': (UserRow._fields, 'date_added'),
+}
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _parse_timestamp(value, name):
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f'Invalid {name} timestamp: {value}')
+    # Stored timestamps are naive UTC, so an explicit offset is converted first
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def build_export_query(table, after_id=None, since=None, until=None):
+    if table not in EXPORTS:
+        raise ExportError(f'Unknown export: {table}')
+    columns, date_column = EXPORTS[table]
+
+    filters = ['id > ?']
+    params = [int(after_id or 0)]
+
+    since = _parse_timestamp(since, 'since')
+    until = _parse_timestamp(until, 'until')
+    if since:
+        filters.append(f'{date_column} >= ?')
+        params.append(since)
+    if until:
+        filters.append(f'{date_column} < ?')
+        params.append(until)
+
+    # Ordered by primary key so a client can resume from the last id it saw
+    select_query = f'SELECT {", ".join(columns)} FROM {table} WHERE {" AND ".join(filters)} ORDER BY id;'
+    return select_query, params, columns
+
+
+def iter_rows(conn, select_query, params, batch_size=BATCH_SIZE):
+    cursor = conn.cursor()
+    cursor.execute(select_query, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def stream_ndjson(batches, columns):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), separators=(',', ':')) + '\n' for row in rows)
+
+
+def stream_csv(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+WRITERS = {
+    'ndjson': stream_ndjson,
+    'csv': stream_csv,
+}
@@ -0,0 +1,169 @@
+import db
+from model import TABLES, create_table, create_index
+from sessions import timestamp, expires_in
+
+# Reservation ledger for cart stock. Every cart line holds its quantity
+# until the hold expires; available stock is stock_quantity minus the
+# active holds of other users, summed from a covering index. Holds are
+# placed inside the cart write's BEGIN IMMEDIATE transaction, so two carts
+# racing for the last units of a product are serialized on the write lock
+# and the loser sees the winner's hold.
+HOLD_TTL = 15 * 60.0
+SWEEP_INTERVAL = 60.0
+SWEEP_BATCH = 500
+SWEEP_PAUSE = 0.05
+
+HOLD_INDEXES = {
+    'idx_stock_holds_user_product': ('user_id, product_id', True),
+    # Covers the available stock aggregate without touching the table
+    'idx_stock_holds_product_expires': ('product_id, expires_at, user_id, quantity', False),
+    'idx_stock_holds_expires_at': ('expires_at', False),
+}
+
+AVAILABLE_QUERY = '''
+    SELECT p.stock_quantity - (
+        SELECT COALESCE(SUM(h.quantity), 0) FROM stock_holds h
+        WHERE h.product_id = p.id AND h.expires_at > ? AND h.user_id IS NOT ?
+    )
+    FROM products p
+    WHERE p.id = ?;
+'''
+
+# The cart quantity of each line against what other users leave available;
+# p.id is NULL when the product does not exist
+CART_LINE_QUERY = '''
+    SELECT c.quantity, p.id, p.stock_quantity - (
+        SELECT COALESCE(SUM(h.quantity), 0) FROM stock_holds h
+        WHERE h.product_id = c.product_id AND h.expires_at > ? AND h.user_id != c.user_id
+    )
+    FROM carts c
+    LEFT JOIN products p ON p.id = c.product_id
+    WHERE c.user_id = ? AND c.product_id = ?;
+'''
+
+HOLD_QUERY = '''
+    INSERT INTO stock_holds (user_id, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id, product_id) DO UPDATE SET
+        quantity = excluded.quantity,
+        expires_at = excluded.expires_at;
+'''
+
+# Activity on the cart keeps the rest of its live holds alive too
+EXTEND_QUERY = '''
+    UPDATE stock_holds SET expires_at = ?
+    WHERE user_id = ? AND expires_at > ?;
+'''
+
+RELEASE_QUERY = '''
+    DELETE FROM stock_holds WHERE user_id = ? AND product_id = ?;
+'''
+
+RELEASE_ALL_QUERY = '''
+    DELETE FROM stock_holds WHERE user_id = ?;
+'''
+
+SWEEP_QUERY = '''
+    DELETE FROM stock_holds WHERE id IN (
+        SELECT id FROM stock_holds WHERE expires_at <= ? LIMIT ?
+    );
+'''
+
+
+class InvalidHoldError(ValueError):
+    def __init__(self, product_ids):
+        super().__init__(f'Invalid cart quantity for products: {", ".join(map(str, product_ids))}')
+        self.product_ids = product_ids
+
+
+class UnknownProductError(ValueError):
+    def __init__(self, product_ids):
+        super().__init__(f'Unknown products: {", ".join(map(str, product_ids))}')
+        self.product_ids = product_ids
+
+
+class InsufficientStockError(ValueError):
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock for products: {", ".join(map(str, product_ids))}')
+        self.product_ids = product_ids
+
+
+def create_stock_holds(conn):
+    create_table(conn, 'stock_holds', TABLES['stock_holds'])
+    for index_name, (columns, unique) in HOLD_INDEXES.items():
+        create_index(conn, index_name, 'stock_holds', columns, unique=unique)
+
+
+def add_quantity_check(conn):
+    # SQLite cannot add a CHECK to an existing table, so rebuild it once.
+    # A hold of zero or less was never valid and is not carried over.
+    table_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'stock_holds';").fetchone()[0]
+    if 'CHECK' in table_sql:
+        return
+    create_table(conn, 'stock_holds_new', TABLES['stock_holds'])
+    conn.execute('''
+        INSERT INTO stock_holds_new (id, user_id, product_id, quantity, expires_at)
+        SELECT id, user_id, product_id, quantity, expires_at FROM stock_holds WHERE quantity > 0;
+    ''')
+    conn.execute('DROP TABLE stock_holds;')
+    conn.execute('ALTER TABLE stock_holds_new RENAME TO stock_holds;')
+    create_stock_holds(conn)
+
+
+def available_stock(conn, product_id, user_id=None):
+    """Stock left for ``user_id`` (or anyone) after other active holds, or None for an unknown product."""
+    row = conn.execute(AVAILABLE_QUERY, (timestamp(), user_id, product_id)).fetchone()
+    return None if row is None else row[0]
+
+
+def hold_cart_lines(conn, user_id, product_ids, ttl=HOLD_TTL):
+    """Hold stock for the given lines of the user's cart at their current quantity.
+
+    Must run inside the write transaction that changed the cart, so a
+    shortfall rolls the cart change back with it. Every line is checked
+    before any hold is written: InvalidHoldError for a quantity that is not
+    a positive integer, UnknownProductError for a product that does not
+    exist, then InsufficientStockError, each listing every product affected.
+    """
+    now = timestamp()
+    expires_at = expires_in(ttl)
+
+    lines = []
+    for product_id in product_ids:
+        row = conn.execute(CART_LINE_QUERY, (now, user_id, product_id)).fetchone()
+        if row is not None:
+            quantity, found, available = row
+            lines.append((product_id, quantity, found, available))
+
+    # A negative hold would make stock look free to every other shopper
+    invalid = [product_id for product_id, quantity, _, _ in lines if type(quantity) is not int or quantity < 1]
+    if invalid:
+        raise InvalidHoldError(invalid)
+
+    unknown = [product_id for product_id, _, found, _ in lines if found is None]
+    if unknown:
+        raise UnknownProductError(unknown)
+
+    short = [product_id for product_id, quantity, _, available in lines if available < quantity]
+    if short:
+        raise InsufficientStockError(short)
+
+    holds = [(user_id, product_id, quantity, expires_at) for product_id, quantity, _, _ in lines]
+
+    conn.execute(EXTEND_QUERY, (expires_at, user_id, now))
+    conn.executemany(HOLD_QUERY, holds)
+
+
+def release_holds(conn, user_id, product_ids=None):
+    if product_ids is None:
+        conn.execute(RELEASE_ALL_QUERY, (user_id,))
+    else:
+        conn.executemany(RELEASE_QUERY, [(user_id, product_id) for product_id in product_ids])
+
+
+def sweep_expired(conn, batch_size=SWEEP_BATCH, pause=SWEEP_PAUSE):
+    # Expired holds already count for nothing; this only keeps the ledger small
+    return db.delete_in_batches(conn, SWEEP_QUERY, (timestamp(),), batch_size, pause)
+
+
+def start_sweeper(interval=SWEEP_INTERVAL, batch_size=SWEEP_BATCH):
+    return db.start_sweeper('hold-sweeper', sweep_expired, interval, batch_size)
@@ -0,0 +1,252 @@
+import csv
+import json
+import math
+import os
+import time
+from itertools import dropwhile, islice
+from db import transaction
+from catalog import CATALOG_INDEXES, RATING_INDEXES
+from model import add_column, create_index
+import cache
+import search
+import versions
+
+# Streaming product feed importer. Rows are parsed lazily, validated a
+# batch at a time and upserted on sku with executemany, one transaction
+# per batch, so memory stays flat whatever the feed size.
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+FORMATS = ('csv', 'ndjson')
+REQUIRED_FIELDS = ('sku', 'name', 'price')
+
+UPSERT_QUERY = '''
+    INSERT INTO products (sku, name, description, price, stock_quantity, category_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (sku) DO UPDATE SET
+        name = excluded.name,
+        description = excluded.description,
+        price = excluded.price,
+        stock_quantity = excluded.stock_quantity,
+        category_id = excluded.category_id
+    WHERE products.name IS NOT excluded.name
+        OR products.description IS NOT excluded.description
+        OR products.price IS NOT excluded.price
+        OR products.stock_quantity IS NOT excluded.stock_quantity
+        OR products.category_id IS NOT excluded.category_id;
+'''
+
+# Stands in for the dropped per-row version triggers, once per batch
+BUMP_PRODUCTS_QUERY = "UPDATE table_versions SET version = version + 1 WHERE name = 'products';"
+
+# Secondary product indexes that can be rebuilt once after a large initial load
+PRODUCT_INDEXES = {name: columns for name, (table, columns) in {**CATALOG_INDEXES, **RATING_INDEXES}.items()
+                   if table == 'products'}
+PRODUCT_INDEXES['idx_products_avg_rating'] = 'avg_rating'
+
+# Per-row version bumps, replaced by one bump per batch. The FTS triggers
+# stay on unless indexes are deferred, so only the rows a feed actually
+# changes are re-indexed.
+DEFERRED_TRIGGERS = [name for name in versions.VERSION_TRIGGERS if name.startswith('products_')]
+
+
+class FeedError(ValueError):
+    pass
+
+
+def create_sku_index(conn):
+    # Supplier SKU is the upsert key; products created through the app have none
+    add_column(conn, 'products', 'sku', 'TEXT')
+    create_index(conn, 'idx_products_sku', 'products', 'sku', unique=True)
+
+
+def read_feed(f, feed_format):
+    """Yield (record_number, record) pairs from an open text file, one at a time.
+
+    CSV records are dicts numbered from 1. NDJSON records are the raw
+    lines, numbered by line and parsed in validate(), so a malformed line
+    is rejected like any other bad record.
+    """
+    if feed_format == 'csv':
+        records = csv.DictReader(f)
+        missing = [field for field in REQUIRED_FIELDS if field not in (records.fieldnames or ())]
+        if missing:
+            raise FeedError(f'CSV header is missing: {", ".join(missing)}')
+        return enumerate(records, start=1)
+    if feed_format == 'ndjson':
+        return ((number, line) for number, line in enumerate(f, start=1) if line.strip())
+    raise FeedError(f'Unknown feed format: {feed_format}')
+
+
+def validate(record):
+    """Return (sku, name, description, price, stock_quantity, category name) or raise ValueError."""
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise ValueError(f'invalid JSON: {e}')
+    if not isinstance(record, dict):
+        raise ValueError('record is not an object')
+
+    sku = str(record.get('sku') or '').strip()
+    name = str(record.get('name') or '').strip()
+    if not sku:
+        raise ValueError('missing sku')
+    if not name:
+        raise ValueError('missing name')
+
+    try:
+        price = float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid price: {record.get("price")!r}')
+    if not math.isfinite(price) or price < 0:
+        raise ValueError(f'invalid price: {record.get("price")!r}')
+
+    try:
+        stock_quantity = int(record.get('stock_quantity') or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid stock_quantity: {record.get("stock_quantity")!r}')
+    if stock_quantity < 0:
+        raise ValueError(f'invalid stock_quantity: {stock_quantity}')
+
+    description = str(record.get('description') or '')
+    category = str(record.get('category') or '').strip() or None
+    return sku, name, description, price, stock_quantity, category
+
+
+def load_categories(conn):
+    return {name: category_id for category_id, name in conn.execute('SELECT id, name FROM categories;')}
+
+
+def resolve_category(conn, categories, name, create):
+    # Called inside the batch transaction, so a new category commits with its products
+    if name is None:
+        return None
+    category_id = categories.get(name)
+    if category_id is None and create:
+        category_id = conn.execute('INSERT INTO categories (name) VALUES (?);', (name,)).lastrowid
+        categories[name] = category_id
+    return category_id
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(path, state):
+    # Written after each committed batch; replace() keeps it whole on a crash
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(state, f)
+    os.replace(temporary, path)
+
+
+def interrupted_import(conn):
+    """Names of the triggers and indexes import_products may drop that are missing.
+
+    Only non-empty when an import was killed before its cleanup ran.
+    """
+    present = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('trigger', 'index');")}
+    return [name for name in [*DEFERRED_TRIGGERS, *search.FTS_TRIGGERS, *PRODUCT_INDEXES] if name not in present]
+
+
+def restore_after_import(conn):
+    # Put back what the import dropped. The search index is only rebuilt if
+    # its triggers were dropped, which only a deferred-index load does.
+    with transaction(conn):
+        for index_name, columns in PRODUCT_INDEXES.items():
+            create_index(conn, index_name, 'products', columns)
+        if any(name in interrupted_import(conn) for name in search.FTS_TRIGGERS):
+            search.create_search_index(conn)
+            search.rebuild_search_index(conn)
+        versions.create_versions(conn)
+        conn.execute("UPDATE table_versions SET version = version + 1 WHERE name IN ('products', 'categories');")
+    cache.invalidate_products()
+    cache.invalidate_categories()
+
+
+def import_products(conn, f, feed_format='csv', batch_size=BATCH_SIZE, checkpoint=None, create_categories=True,
+                    defer_indexes=False, progress=None):
+    """Upsert every valid product in a feed.
+
+    With ``checkpoint`` set, progress is saved after each batch and a rerun
+    with the same file skips the records already committed. Rows identical
+    to the feed are left untouched, so the FTS triggers re-index only what
+    changed. The per-row products version triggers are dropped for the
+    duration; each batch bumps the version and drops cached products once
+    it commits, so ETags and the catalog cache never outlive the data.
+    ``defer_indexes`` also drops the FTS triggers and the secondary product
+    indexes and rebuilds them once at the end, which is only worth it for
+    large initial loads. If the process dies before they
+    are restored, migrations.ensure_schema() restores them on the next
+    start. Returns a summary dict.
+    """
+    state = read_checkpoint(checkpoint) or {'records': 0, 'upserted': 0, 'rejected': 0}
+    resumed_from = state['records']
+    errors = []
+    categories = load_categories(conn)
+    categories_created = 0
+    started = time.perf_counter()
+
+    with transaction(conn):
+        for trigger_name in DEFERRED_TRIGGERS:
+            conn.execute(f'DROP TRIGGER IF EXISTS {trigger_name};')
+        if defer_indexes:
+            search.drop_search_triggers(conn)
+            for index_name in PRODUCT_INDEXES:
+                conn.execute(f'DROP INDEX IF EXISTS {index_name};')
+
+    try:
+        records = dropwhile(lambda item: item[0] <= resumed_from, read_feed(f, feed_format))
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+
+            valid = []
+            for number, record in batch:
+                try:
+                    valid.append(validate(record))
+                except ValueError as e:
+                    state['rejected'] += 1
+                    if len(errors) < MAX_REPORTED_ERRORS:
+                        errors.append({'record': number, 'error': str(e)})
+
+            with transaction(conn):
+                known = len(categories)
+                rows = [(sku, name, description, price, stock_quantity,
+                         resolve_category(conn, categories, category, create_categories))
+                        for sku, name, description, price, stock_quantity, category in valid]
+                conn.executemany(UPSERT_QUERY, rows)
+                conn.execute(BUMP_PRODUCTS_QUERY)
+                categories_created += len(categories) - known
+            cache.invalidate_products()
+
+            state['records'] = batch[-1][0]
+            state['upserted'] += len(valid)
+            if checkpoint:
+                write_checkpoint(checkpoint, state)
+            if progress:
+                progress(state, state['records'] - resumed_from, time.perf_counter() - started)
+
+        # Finished: a rerun should start from the top again
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+    finally:
+        restore_after_import(conn)
+
+    seconds = time.perf_counter() - started
+    processed = state['records'] - resumed_from
+    return {
+        'records': state['records'],
+        'resumed_from': resumed_from,
+        'upserted': state['upserted'],
+        'rejected': state['rejected'],
+        'categories_created': categories_created,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(processed / seconds, 1) if seconds else None,
+        'errors': errors,
+    }
@@ -0,0 +1,268 @@
+import bisect
+import cProfile
+import io
+import logging
+import pstats
+import random
+import sqlite3
+import threading
+import time
+from flask import g, request, Response
+from flask_login import current_user
+import cache
+import db
+import writebehind
+
+SLOW_QUERY_THRESHOLD = 0.1
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_TOP = 25
+# X-Profile: 1 is honoured only when enabled, and then only for admins or
+# requests from these addresses
+PROFILE_HEADER_ENABLED = False
+PROFILE_TRUSTED_ADDRESSES = ()
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+logger = logging.getLogger('instrumentation')
+
+# Per-request counters, visible to whichever pooled connection the request
+# thread is using
+_current = threading.local()
+
+# Only one profiler can run at a time (on 3.12+ a second one raises), so
+# a request that would overlap a running profile is not profiled
+_profiler_lock = threading.Lock()
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(labels)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_labels(labels + (("le", "+Inf"),))} {counts[-1]}')
+                lines.append(f'{self.name}_sum{_labels(labels)} {counts[-2]}')
+                lines.append(f'{self.name}_count{_labels(labels)} {counts[-1]}')
+        return lines
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+requests_total = Counter('http_requests_total', 'HTTP requests by endpoint, method and status.')
+request_duration = Histogram('http_request_duration_seconds', 'HTTP request latency by endpoint.', REQUEST_BUCKETS)
+queries_per_request = Histogram('sql_queries_per_request', 'SQL statements issued per request by endpoint.', QUERY_COUNT_BUCKETS)
+query_duration = Histogram('sql_query_duration_seconds', 'SQL statement latency by endpoint.', QUERY_BUCKETS)
+slow_queries_total = Counter('sql_slow_queries_total', 'SQL statements slower than the slow-query threshold.')
+traced_statements_total = Counter('sql_traced_statements_total', 'Statements run by SQLite, including triggers and transaction control.')
+
+METRICS = [requests_total, request_duration, queries_per_request, query_duration, slow_queries_total, traced_statements_total]
+
+# name -> callable returning a flat dict of numbers, exported as gauges
+_gauge_sources = {}
+
+
+def register_gauges(prefix, source):
+    _gauge_sources[prefix] = source
+
+
+# Caches and queues are replaced on reconfigure, so look them up on every scrape
+register_gauges('db_pool', db.pool_stats)
+register_gauges('catalog_cache', lambda: cache.catalog_cache.stats())
+register_gauges('identity_cache', lambda: cache.identity_cache.stats())
+register_gauges('view_queue', lambda: writebehind.view_queue.stats())
+
+
+def _record_query(sql, elapsed):
+    endpoint = getattr(_current, 'endpoint', None) or 'background'
+    query_duration.observe(elapsed, (('endpoint', endpoint),))
+    if hasattr(_current, 'queries'):
+        _current.queries += 1
+    if elapsed >= SLOW_QUERY_THRESHOLD:
+        slow_queries_total.inc((('endpoint', endpoint),))
+        logger.warning('Slow query (%.1f ms) on %s: %s', elapsed * 1000, endpoint, ' '.join(sql.split()))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute() does not go through cursor(), so route it explicitly
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _trace(statement):
+    traced_statements_total.inc()
+
+
+def install_trace(conn):
+    conn.set_trace_callback(_trace)
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _before_request():
+    g.instrumentation_started = time.perf_counter()
+    _current.endpoint = _endpoint()
+    _current.queries = 0
+
+    if (_profile_requested() or random.random() < PROFILE_SAMPLE_RATE) and _profiler_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Some other tool is already profiling this process
+            _profiler_lock.release()
+        else:
+            g.profiler = profiler
+
+
+def _profile_requested():
+    if not PROFILE_HEADER_ENABLED or request.headers.get('X-Profile') != '1':
+        return False
+    if request.remote_addr in PROFILE_TRUSTED_ADDRESSES:
+        return True
+    return current_user.is_authenticated and current_user.is_admin
+
+
+def _stop_profiler():
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    profiler.disable()
+    _profiler_lock.release()
+    return profiler
+
+
+def _after_request(response):
+    profiler = _stop_profiler()
+    if profiler is not None:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        logger.info('Profile for %s %s:\n%s', request.method, request.path, output.getvalue())
+
+    started = g.pop('instrumentation_started', None)
+    if started is not None:
+        endpoint = _current.endpoint
+        requests_total.inc((('endpoint', endpoint), ('method', request.method), ('status', response.status_code)))
+        request_duration.observe(time.perf_counter() - started, (('endpoint', endpoint),))
+        queries_per_request.observe(_current.queries, (('endpoint', endpoint),))
+        response.headers['X-Query-Count'] = str(_current.queries)
+
+    _current.endpoint = None
+    _current.__dict__.pop('queries', None)
+    return response
+
+
+def _teardown_request(_exception):
+    # after_request is skipped when a request fails outright; never leave
+    # the profiler running or its lock held
+    _stop_profiler()
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for prefix, source in sorted(_gauge_sources.items()):
+        for key, value in sorted(source().items()):
+            if isinstance(value, (int, float)):
+                lines.append(f'# TYPE {prefix}_{key} gauge')
+                lines.append(f'{prefix}_{key} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Expose /metrics and, when INSTRUMENTATION_ENABLED is set, time requests and SQL.
+
+    With instrumentation disabled the pool keeps plain sqlite3 connections
+    and no request hooks are installed, so the only cost is the route.
+    """
+    global SLOW_QUERY_THRESHOLD, PROFILE_SAMPLE_RATE, PROFILE_HEADER_ENABLED, PROFILE_TRUSTED_ADDRESSES
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    if not app.config.get('INSTRUMENTATION_ENABLED'):
+        return
+
+    SLOW_QUERY_THRESHOLD = app.config.get('SLOW_QUERY_THRESHOLD', SLOW_QUERY_THRESHOLD)
+    PROFILE_SAMPLE_RATE = app.config.get('PROFILE_SAMPLE_RATE', PROFILE_SAMPLE_RATE)
+    PROFILE_HEADER_ENABLED = app.config.get('PROFILE_HEADER_ENABLED', PROFILE_HEADER_ENABLED)
+    PROFILE_TRUSTED_ADDRESSES = tuple(app.config.get('PROFILE_TRUSTED_ADDRESSES', PROFILE_TRUSTED_ADDRESSES))
+
+    db.configure(app.config['DATABASE'], factory=InstrumentedConnection, on_connect=install_trace)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,201 @@
+import sqlite3
+from db import get_db
+from model import TABLES, create_table, create_index, add_column
+from catalog import CATALOG_INDEXES, RATING_INDEXES
+import search
+import stats
+import pagination
+import ratings
+import sessions
+import versions
+import importer
+import holds
+
+
+BASE_TABLES = ('users', 'products', 'orders', 'categories', 'carts', 'reviews', 'addresses', 'payments', 'sessions')
+
+
+def create_base_tables(conn):
+    for table_name in BASE_TABLES:
+        create_table(conn, table_name, TABLES[table_name])
+
+
+def create_catalog_indexes(conn):
+    for index_name, (table_name, columns) in CATALOG_INDEXES.items():
+        create_index(conn, index_name, table_name, columns)
+
+
+def create_category_sort_indexes(conn):
+    # Existing catalogs only have the indexes CATALOG_INDEXES held at migration 2
+    for index_name, (table_name, columns) in {**CATALOG_INDEXES, **RATING_INDEXES}.items():
+        create_index(conn, index_name, table_name, columns)
+
+
+def create_product_search_index(conn):
+    search.create_search_index(conn)
+    search.rebuild_search_index(conn)
+
+
+# Foreign-key and lookup columns used by the per-user routes
+LOOKUP_INDEXES = {
+    'idx_orders_user_id': ('orders', 'user_id'),
+    'idx_carts_user_id': ('carts', 'user_id'),
+    'idx_carts_product_id': ('carts', 'product_id'),
+    'idx_reviews_user_id': ('reviews', 'user_id'),
+    'idx_reviews_product_id': ('reviews', 'product_id'),
+    'idx_addresses_user_id': ('addresses', 'user_id'),
+    'idx_payments_user_id': ('payments', 'user_id'),
+    'idx_payments_order_id': ('payments', 'order_id'),
+    'idx_sessions_user_id': ('sessions', 'user_id'),
+    'idx_sessions_session_token': ('sessions', 'session_token'),
+}
+
+
+def create_lookup_indexes(conn):
+    for index_name, (table_name, columns) in LOOKUP_INDEXES.items():
+        create_index(conn, index_name, table_name, columns)
+
+
+def create_cart_unique_index(conn):
+    # Merge duplicate cart lines left by the old insert-only add_to_cart
+    conn.execute('''
+        UPDATE carts SET quantity = (
+            SELECT SUM(c.quantity) FROM carts c
+            WHERE c.user_id = carts.user_id AND c.product_id = carts.product_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM carts GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        );
+    ''')
+    conn.execute('''
+        DELETE FROM carts WHERE id NOT IN (
+            SELECT MIN(id) FROM carts GROUP BY user_id, product_id
+        );
+    ''')
+    create_index(conn, 'idx_carts_user_product', 'carts', 'user_id, product_id', unique=True)
+    # Covered by the unique index's leading column
+    conn.execute('DROP INDEX IF EXISTS idx_carts_user_id;')
+
+
+def create_order_items_table(conn):
+    create_table(conn, 'order_items', TABLES['order_items'])
+    create_index(conn, 'idx_order_items_order_id', 'order_items', 'order_id')
+    create_index(conn, 'idx_order_items_product_id', 'order_items', 'product_id')
+
+
+def create_user_list_indexes(conn):
+    for table_name, date_column in pagination.USER_LISTS.items():
+        create_index(conn, f'idx_{table_name}_user_{date_column}', table_name, f'user_id, {date_column}')
+    # Superseded by the composite indexes above
+    for table_name in ('orders', 'reviews', 'addresses', 'payments', 'sessions'):
+        conn.execute(f'DROP INDEX IF EXISTS idx_{table_name}_user_id;')
+
+
+def create_product_neighbors_table(conn):
+    # Filled by recommender.build_recommendations(), top neighbours in rank order
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_neighbors (
+            product_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            neighbor_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (product_id, rank)
+        ) WITHOUT ROWID;
+    ''')
+
+
+def create_product_views_table(conn):
+    create_table(conn, 'product_views', TABLES['product_views'])
+    create_index(conn, 'idx_product_views_user_view_date', 'product_views', 'user_id, view_date')
+
+
+def create_admin_flag(conn):
+    # Set with: flask --app routes set-admin <username>
+    add_column(conn, 'users', 'is_admin', 'INTEGER NOT NULL DEFAULT 0')
+
+
+# Ordered (version, name, apply) list. Append only: never renumber or edit a
+# migration once it has shipped, add a new one instead. Every step must be
+# safe to re-run against a database that already has its objects.
+MIGRATIONS = [
+    (1, 'create base tables', create_base_tables),
+    (2, 'catalog indexes', create_catalog_indexes),
+    (3, 'product search index', create_product_search_index),
+    (4, 'foreign key and lookup indexes', create_lookup_indexes),
+    (5, 'unique cart lines', create_cart_unique_index),
+    (6, 'order line items', create_order_items_table),
+    (7, 'store stats summary', stats.create_store_stats),
+    (8, 'per-user list indexes', create_user_list_indexes),
+    (9, 'product rating summaries', ratings.create_product_ratings),
+    (10, 'product recommendations', create_product_neighbors_table),
+    (11, 'unique session tokens', sessions.create_session_index),
+    (12, 'product views', create_product_views_table),
+    (13, 'response version counters', versions.create_versions),
+    (14, 'product sku', importer.create_sku_index),
+    (15, 'cart stock holds', holds.create_stock_holds),
+    (16, 'category sort indexes', create_category_sort_indexes),
+    (17, 'admin users', create_admin_flag),
+    (18, 'covering session lookup index', sessions.create_session_lookup_index),
+    (19, 'positive stock hold quantities', holds.add_quantity_check),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    # PRAGMA user_version mirrors the schema_version table and is a header read
+    return conn.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def applied_versions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    return {row[0] for row in conn.execute('SELECT version FROM schema_version;')}
+
+
+def migrate(conn):
+    """Apply every pending migration in a single transaction.
+
+    Returns the list of versions applied. The write lock is taken up front
+    so concurrent workers booting together apply each migration once.
+    """
+    conn.execute('BEGIN IMMEDIATE;')
+    try:
+        done = applied_versions(conn)
+        pending = [migration for migration in MIGRATIONS if migration[0] not in done]
+
+        for version, name, apply in pending:
+            apply(conn)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?);', (version, name))
+
+        conn.execute(f'PRAGMA user_version = {LATEST_VERSION};')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return [version for version, _, _ in pending]
+
+
+def ensure_schema():
+    # Cheap startup check: a current database costs one pragma read and one
+    # sqlite_master scan
+    try:
+        with get_db() as conn:
+            applied = migrate(conn) if current_version(conn) < LATEST_VERSION else []
+
+            # A product import killed mid-run leaves version triggers and indexes dropped
+            missing = importer.interrupted_import(conn)
+            if missing:
+                print("Restoring objects left dropped by an interrupted product import:", ', '.join(missing))
+                importer.restore_after_import(conn)
+
+            return applied
+    except sqlite3.Error as e:
+        print("Error migrating database schema:", e)
+        raise
@@ -0,0 +1,77 @@
+import base64
+import json
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# Per-user list tables -> timestamp column they are paged on, newest first.
+# Each has a (user_id, <timestamp>) index; the rowid tiebreaker is implicit
+# in every SQLite index, so a page is a single index range scan.
+USER_LISTS = {
+    'orders': 'order_date',
+    'carts': 'date_added',
+    'reviews': 'date_added',
+    'addresses': 'date_added',
+    'payments': 'date_added',
+    'sessions': 'date_created',
+}
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise PaginationError('Invalid cursor')
+    if not isinstance(values, list):
+        raise PaginationError('Invalid cursor')
+    return values
+
+
+def clamp_limit(limit):
+    if limit is None:
+        return DEFAULT_LIMIT
+    return max(1, min(int(limit), MAX_LIMIT))
+
+
+def user_page(conn, row_class, table, user_id, cursor=None, limit=None):
+    """Return one newest-first page of a user's rows and the cursor for the next."""
+    date_column = USER_LISTS[table]
+    limit = clamp_limit(limit)
+
+    filters = ['user_id = ?']
+    params = [user_id]
+
+    if cursor:
+        values = decode_cursor(cursor)
+        # Cursors come back from clients, so only a (timestamp text, integer id) pair is bound
+        if len(values) != 2 or not isinstance(values[0], str) or type(values[1]) is not int:
+            raise PaginationError('Invalid cursor')
+        filters.append(f'({date_column}, id) < (?, ?)')
+        params.extend(values)
+
+    select_query = f'''
+        SELECT {row_class.columns} FROM {table}
+        WHERE {' AND '.join(filters)}
+        ORDER BY {date_column} DESC, id DESC
+        LIMIT ?;
+    '''
+    params.append(limit + 1)
+
+    page = row_class.select(conn, select_query, params).fetchall()
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        last = page[-1]
+        next_cursor = encode_cursor([getattr(last, date_column), last.id])
+
+    return page, next_cursor
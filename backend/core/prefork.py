@@ -0,0 +1,115 @@
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+from werkzeug.serving import make_server
+import db
+import holds
+import migrations
+import sessions
+import stats
+import writebehind
+from routes import app
+
+# Pre-fork launcher: one listening socket shared by several worker
+# processes, each a threaded WSGI server with its own connection pool.
+# SQLite in WAL mode handles the cross-process locking; write routes retry
+# on SQLITE_BUSY and catalog reads can go to per-worker snapshot replicas.
+WORKERS = os.cpu_count() or 2
+BACKLOG = 1024
+
+
+def listen(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, index):
+    # Forked children start with an empty connection pool (see db._reset_after_fork)
+    server = make_server(*sock.getsockname()[:2], app, threaded=True, fd=sock.fileno())
+
+    def stop(signum, frame):
+        # shutdown() blocks until serve_forever returns, so it cannot run on this thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    db.configure_replica(app.config['READ_REPLICA_INTERVAL'])
+    # Store-wide background jobs only need one process
+    if index == 0:
+        stats.start_reconciler(app.config['STATS_RECONCILE_INTERVAL'])
+        sessions.start_sweeper(app.config['SESSION_SWEEP_INTERVAL'], app.config['SESSION_SWEEP_BATCH'])
+        holds.start_sweeper(app.config['HOLD_SWEEP_INTERVAL'], app.config['HOLD_SWEEP_BATCH'])
+
+    print(f'Worker {index} (pid {os.getpid()}) serving on {server.server_address}')
+    server.serve_forever()
+    writebehind.view_queue.stop()
+    db.configure_replica(None)
+
+
+def serve(host='127.0.0.1', port=5000, workers=WORKERS):
+    migrations.ensure_schema()
+    # The supervisor opens no connections or threads the workers could inherit
+    db.get_pool().close()
+
+    sock = listen(host, port)
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(sock, index)
+            except Exception as e:
+                print(f'Worker {index} failed:', e)
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f'Worker {index} (pid {pid}) exited with status {status}, restarting')
+            spawn(index)
+
+    sock.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the backend with several worker processes.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--replica-interval', type=float, help='refresh catalog read snapshots every N seconds')
+    args = parser.parse_args()
+
+    if args.replica_interval:
+        app.config['READ_REPLICA_INTERVAL'] = args.replica_interval
+    serve(args.host, args.port, args.workers)
+    sys.exit(0)
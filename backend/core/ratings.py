@@ -0,0 +1,104 @@
+from db import transaction
+from model import create_index, add_column
+
+STARS = range(1, 6)
+
+# Per-product review summary, updated by triggers in the same transaction as
+# the review write. avg_rating and rating_count are also copied onto products
+# so the catalog can sort and filter by rating from its own index.
+CREATE_RATINGS_TABLE = f'''
+    CREATE TABLE IF NOT EXISTS product_ratings (
+        product_id INTEGER PRIMARY KEY,
+        rating_count INTEGER NOT NULL DEFAULT 0,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        {', '.join(f'stars_{star} INTEGER NOT NULL DEFAULT 0' for star in STARS)},
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    );
+'''
+
+
+def _apply(row, sign):
+    # Statements that add (sign '+') or remove (sign '-') one review from the summary
+    stars = ', '.join(f'stars_{star} = stars_{star} {sign} ({row}.rating = {star})' for star in STARS)
+    return f'''
+            INSERT OR IGNORE INTO product_ratings (product_id) VALUES ({row}.product_id);
+            UPDATE product_ratings
+            SET rating_count = rating_count {sign} 1, rating_sum = rating_sum {sign} {row}.rating, {stars}
+            WHERE product_id = {row}.product_id;
+            UPDATE products
+            SET (rating_count, avg_rating) = (
+                SELECT rating_count, COALESCE(CAST(rating_sum AS REAL) / NULLIF(rating_count, 0), 0)
+                FROM product_ratings WHERE product_id = {row}.product_id
+            )
+            WHERE id = {row}.product_id;
+    '''
+
+
+RATINGS_TRIGGERS = {
+    'product_ratings_ai': f'''
+        CREATE TRIGGER IF NOT EXISTS product_ratings_ai AFTER INSERT ON reviews BEGIN
+            {_apply('new', '+')}
+        END;
+    ''',
+    'product_ratings_ad': f'''
+        CREATE TRIGGER IF NOT EXISTS product_ratings_ad AFTER DELETE ON reviews BEGIN
+            {_apply('old', '-')}
+        END;
+    ''',
+    'product_ratings_au': f'''
+        CREATE TRIGGER IF NOT EXISTS product_ratings_au AFTER UPDATE OF rating, product_id ON reviews BEGIN
+            {_apply('old', '-')}
+            {_apply('new', '+')}
+        END;
+    ''',
+}
+
+
+def create_product_ratings(conn):
+    add_column(conn, 'products', 'avg_rating', 'REAL NOT NULL DEFAULT 0')
+    add_column(conn, 'products', 'rating_count', 'INTEGER NOT NULL DEFAULT 0')
+    conn.execute(CREATE_RATINGS_TABLE)
+    for trigger_query in RATINGS_TRIGGERS.values():
+        conn.execute(trigger_query)
+    create_index(conn, 'idx_products_avg_rating', 'products', 'avg_rating')
+    recompute_product_ratings(conn)
+
+
+def recompute_product_ratings(conn):
+    stars = ', '.join(f'SUM(rating = {star})' for star in STARS)
+    conn.execute('DELETE FROM product_ratings;')
+    conn.execute(f'''
+        INSERT INTO product_ratings
+        SELECT product_id, COUNT(*), SUM(rating), {stars}
+        FROM reviews
+        GROUP BY product_id;
+    ''')
+    conn.execute('''
+        UPDATE products SET (rating_count, avg_rating) = (
+            SELECT COALESCE(r.rating_count, 0), COALESCE(CAST(r.rating_sum AS REAL) / NULLIF(r.rating_count, 0), 0)
+            FROM (SELECT 1) LEFT JOIN product_ratings r ON r.product_id = products.id
+        );
+    ''')
+
+
+def backfill_product_ratings(conn):
+    with transaction(conn):
+        recompute_product_ratings(conn)
+
+
+RATING_QUERY = f'''
+    SELECT rating_count, rating_sum, {', '.join(f'stars_{star}' for star in STARS)}
+    FROM product_ratings WHERE product_id = ?;
+'''
+
+
+def get_product_rating(conn, product_id):
+    row = conn.execute(RATING_QUERY, (product_id,)).fetchone()
+    if row is None:
+        return {'rating_count': 0, 'average': 0, 'histogram': {star: 0 for star in STARS}}
+    rating_count, rating_sum, *histogram = row
+    return {
+        'rating_count': rating_count,
+        'average': rating_sum / rating_count if rating_count else 0,
+        'histogram': dict(zip(STARS, histogram)),
+    }
@@ -0,0 +1,141 @@
+import time
+import numpy as np
+import scipy.sparse as sp
+from db import transaction
+
+# Item-to-item recommendations from co-purchases. The product_neighbors table
+# is built offline from order lines and carts; the dashboard only reads it,
+# so NumPy and SciPy are needed to build recommendations, not to serve them.
+TOP_K = 20
+READ_BATCH = 100000
+
+BASKET_QUERIES = (
+    # Every order is a basket
+    'SELECT order_id, product_id FROM order_items;',
+    # So is every open cart, keyed by user
+    'SELECT user_id, product_id FROM carts;',
+)
+
+
+def _read_pairs(conn, select_query):
+    cursor = conn.cursor()
+    cursor.execute(select_query)
+    chunks = []
+    while True:
+        batch = cursor.fetchmany(READ_BATCH)
+        if not batch:
+            break
+        chunks.append(np.array(batch, dtype=np.int64))
+    if not chunks:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(chunks)
+
+
+def basket_matrix(conn):
+    """Return a binary baskets x products CSR matrix and the product id of each column."""
+    pairs = [_read_pairs(conn, select_query) for select_query in BASKET_QUERIES]
+
+    product_ids, columns = np.unique(np.concatenate([p[:, 1] for p in pairs]), return_inverse=True)
+
+    # Basket ids from different sources may collide, so number them per source
+    rows = []
+    offset = 0
+    for p in pairs:
+        _, basket_rows = np.unique(p[:, 0], return_inverse=True)
+        rows.append(basket_rows + offset)
+        offset += int(basket_rows.max()) + 1 if len(basket_rows) else 0
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                           shape=(offset, len(product_ids)))
+    # Quantity does not matter and duplicate lines collapse to one
+    matrix.data[:] = 1
+    return matrix, product_ids
+
+
+def top_neighbors(matrix, k=TOP_K):
+    """Cosine-normalized co-occurrence, cut to the top k neighbours per product.
+
+    Returns parallel (product, rank, neighbour, score) arrays over column indices.
+    """
+    co_occurrence = (matrix.T @ matrix).tocoo()
+    counts = np.asarray(matrix.sum(axis=0)).ravel()
+
+    off_diagonal = co_occurrence.row != co_occurrence.col
+    rows = co_occurrence.row[off_diagonal]
+    cols = co_occurrence.col[off_diagonal]
+    scores = co_occurrence.data[off_diagonal] / np.sqrt(counts[rows] * counts[cols])
+
+    # Sort by product, best score first, then keep the first k of each product
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = ranks < k
+
+    return rows[keep], ranks[keep], cols[keep], scores[keep]
+
+
+def build_recommendations(conn, k=TOP_K):
+    started = time.perf_counter()
+
+    matrix, product_ids = basket_matrix(conn)
+    rows, ranks, cols, scores = top_neighbors(matrix, k)
+
+    neighbors = zip(product_ids[rows].tolist(), ranks.tolist(), product_ids[cols].tolist(), scores.tolist())
+
+    # Swap the whole table in one transaction so readers never see a partial build
+    with transaction(conn):
+        conn.execute('DELETE FROM product_neighbors;')
+        conn.executemany('INSERT INTO product_neighbors (product_id, rank, neighbor_id, score) VALUES (?, ?, ?, ?);',
+                         neighbors)
+
+    return {
+        'baskets': matrix.shape[0],
+        'products': matrix.shape[1],
+        'neighbors': int(len(rows)),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def benchmark(database, orders=1000000, products=50000, users=100000, items_per_order=3, seed=0):
+    """Build recommendations over a synthetic order history and time an online lookup."""
+    import dashboard
+    from db import ConnectionPool
+    from migrations import migrate
+
+    pool = ConnectionPool(database, size=1)
+    rng = np.random.default_rng(seed)
+
+    with pool.connection() as conn:
+        migrate(conn)
+        with transaction(conn):
+            conn.executemany('INSERT INTO products (id, name, description, price, stock_quantity) VALUES (?, ?, ?, 1, 1);',
+                             ((i, f'product {i}', 'synthetic') for i in range(1, products + 1)))
+            # Skewed popularity, like a real catalog
+            popularity = rng.zipf(1.3, size=orders * items_per_order) % products + 1
+            order_users = rng.integers(1, users + 1, size=orders)
+            conn.executemany('INSERT INTO orders (id, user_id, total_price, status) VALUES (?, ?, 0, ?);',
+                             zip(range(1, orders + 1), order_users.tolist(), ['complete'] * orders))
+            conn.executemany('INSERT INTO order_items (order_id, product_id, quantity, unit_price) VALUES (?, ?, 1, 1);',
+                             zip(np.repeat(np.arange(1, orders + 1), items_per_order).tolist(), popularity.tolist()))
+
+        build = build_recommendations(conn)
+
+        started = time.perf_counter()
+        lookups = 1000
+        for user_id in rng.integers(1, users + 1, size=lookups).tolist():
+            dashboard.get_personalized_recommendations(conn, user_id)
+        build['lookup_ms'] = round((time.perf_counter() - started) * 1000 / lookups, 3)
+
+    pool.close()
+    return build
+
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    import os
+
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    with tempfile.TemporaryDirectory() as directory:
+        print(benchmark(os.path.join(directory, 'bench.db'), orders=orders))
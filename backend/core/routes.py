@@ -1,48 +1,155 @@
-from flask import Flask, g, request, flash, render_template, redirect, url_for, session
+from flask import Flask, g, request, flash, render_template, redirect, url_for, session, jsonify, make_response, Response, stream_with_context
 import sqlite3
-import contextlib
+import json
+import functools
+import click
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from model import app, get_db, create_user_table, create_products_table, create_categories_table, create_orders_table, create_carts_table, create_reviews_table, create_addresses_table, create_payments_table, create_sessions_table
+from model import rebuild_product_search_index
 import validator
+import db
+from db import get_db, get_read_db
+from dashboard import load_dashboard
+import catalog
+import migrations
+import cache
+import cart
+import checkout
+import stats
+import export
+import rows
+import pagination
+import ratings
+import sessions
+import writebehind
+import versions
+import importer
+import holds
+import instrumentation
 
 app = Flask(__name__)
+app.json = rows.RowJSONProvider(app)
 app.config['SECRET_KEY'] = 'secret'
 app.config['DATABASE'] = 'site.db'
+app.config['DASHBOARD_CONCURRENT'] = False
+app.config['CATALOG_CACHE_MAX_ENTRIES'] = 1024
+app.config['CATALOG_CACHE_MAX_BYTES'] = 16 * 1024 * 1024
+app.config['CATALOG_CACHE_TTL'] = cache.PRODUCTS_TTL
+app.config['IDENTITY_CACHE_MAX_ENTRIES'] = 10000
+app.config['IDENTITY_CACHE_TTL'] = cache.IDENTITY_TTL
+app.config['PASSWORD_HASH_METHOD'] = validator.PASSWORD_HASH_METHOD
+app.config['PASSWORD_HASH_WORKERS'] = validator.PASSWORD_HASH_WORKERS
+app.config['PASSWORD_HASH_MAX_PENDING'] = validator.PASSWORD_HASH_MAX_PENDING
+app.config['PASSWORD_HASH_MAX_PER_CLIENT'] = validator.PASSWORD_HASH_MAX_PER_CLIENT
+app.config['STATS_RECONCILE_INTERVAL'] = stats.RECONCILE_INTERVAL
+app.config['SESSION_TTL'] = sessions.SESSION_TTL
+app.config['SESSION_TOUCH_INTERVAL'] = sessions.TOUCH_INTERVAL
+app.config['SESSION_SWEEP_INTERVAL'] = sessions.SWEEP_INTERVAL
+app.config['SESSION_SWEEP_BATCH'] = sessions.SWEEP_BATCH
+app.config['HOLD_TTL'] = holds.HOLD_TTL
+app.config['HOLD_SWEEP_INTERVAL'] = holds.SWEEP_INTERVAL
+app.config['HOLD_SWEEP_BATCH'] = holds.SWEEP_BATCH
+app.config['VIEW_QUEUE_FLUSH_ROWS'] = writebehind.FLUSH_ROWS
+app.config['VIEW_QUEUE_FLUSH_INTERVAL'] = writebehind.FLUSH_INTERVAL
+app.config['VIEW_QUEUE_CAPACITY'] = writebehind.CAPACITY
+app.config['VIEW_QUEUE_POLICY'] = 'drop'
+app.config['INSTRUMENTATION_ENABLED'] = False
+app.config['SLOW_QUERY_THRESHOLD'] = instrumentation.SLOW_QUERY_THRESHOLD
+app.config['PROFILE_SAMPLE_RATE'] = instrumentation.PROFILE_SAMPLE_RATE
+app.config['PROFILE_HEADER_ENABLED'] = instrumentation.PROFILE_HEADER_ENABLED
+app.config['PROFILE_TRUSTED_ADDRESSES'] = instrumentation.PROFILE_TRUSTED_ADDRESSES
+app.config['READ_REPLICA_INTERVAL'] = None
+# Any setting above can be overridden from the environment before it is
+# applied below, e.g. FLASK_INSTRUMENTATION_ENABLED=true (values parsed as JSON)
+app.config.from_prefixed_env()
+db.configure(app.config['DATABASE'])
+validator.configure_hashing(method=app.config['PASSWORD_HASH_METHOD'],
+                            workers=app.config['PASSWORD_HASH_WORKERS'],
+                            max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+                            max_per_client=app.config['PASSWORD_HASH_MAX_PER_CLIENT'])
+cache.configure_catalog_cache(max_entries=app.config['CATALOG_CACHE_MAX_ENTRIES'],
+                              max_bytes=app.config['CATALOG_CACHE_MAX_BYTES'],
+                              default_ttl=app.config['CATALOG_CACHE_TTL'])
+cache.configure_identity_cache(max_entries=app.config['IDENTITY_CACHE_MAX_ENTRIES'],
+                               max_bytes=None,
+                               default_ttl=app.config['IDENTITY_CACHE_TTL'])
+writebehind.configure_view_queue(flush_rows=app.config['VIEW_QUEUE_FLUSH_ROWS'],
+                                 flush_interval=app.config['VIEW_QUEUE_FLUSH_INTERVAL'],
+                                 capacity=app.config['VIEW_QUEUE_CAPACITY'],
+                                 policy=app.config['VIEW_QUEUE_POLICY'])
+instrumentation.init_app(app)
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
 
+class User(UserMixin):
+    is_admin = False
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    user = get_user_by_id(user_id)
-    if user:
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    # Runs on every authenticated request, so the identity is cached briefly
+    identity = cache.identity_cache.get_or_load(('user', user_id), lambda: get_user_identity(user_id))
+    if identity:
         user_object = User()
-        user_object.id = user[0]
+        user_object.id = identity.id
+        user_object.is_admin = bool(identity.is_admin)
         return user_object
     return None
 
 
-@contextlib.contextmanager
-def get_db():
-    conn = sqlite3.connect(app.config['DATABASE'])
+# Store-wide data: signed in with the admin flag set, else 403. A changed
+# flag applies once the cached identity expires (IDENTITY_CACHE_TTL).
+def admin_required(view):
+    @functools.wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not current_user.is_admin:
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Conditional GET: answer 304 when the client's ETag is current
+def not_modified(etag, cache_control):
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return tag_response(Response(status=304), etag, cache_control)
+
+
+def tag_response(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def get_user_identity(user_id):
     try:
-        yield conn
-    finally:
-        conn.close()
+        with get_db() as conn:
+            select_query = f'''
+            SELECT {rows.IdentityRow.columns} FROM users WHERE id = ?;
+            '''
+
+            return rows.IdentityRow.select(conn, select_query, (user_id,)).fetchone()
+
+    except sqlite3.Error as e:
+        flash(f'Error fetching user details: {e}', 'error')
+        return None
 
 
 def get_user_by_id(user_id):
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
-
-            select_query = '''
-            SELECT * FROM users WHERE id = ?;
+            select_query = f'''
+            SELECT {rows.UserRow.columns} FROM users WHERE id = ?;
             '''
 
-            cursor.execute(select_query, (user_id,))
-            user = cursor.fetchone()
+            user = rows.UserRow.select(conn, select_query, (user_id,)).fetchone()
 
             return user
 
@@ -65,11 +172,12 @@ def register():
             flash(validation_error, 'error')
         else:
             try:
+                # Hash before taking a connection so slow hashing never holds a pool slot
+                hashed_password = validator.hash_password(password1, client=request.remote_addr)
+
                 with get_db() as conn:
                     cursor = conn.cursor()
 
-                    hashed_password = validator.hash_password(password1)
-
                     insert_query = '''
                     INSERT INTO users (username, name, email, password) VALUES (?, ?, ?, ?);
                     '''
@@ -79,6 +187,9 @@ def register():
 
                     flash('Registration successful! Please log in.', 'success')
                     return redirect(url_for('login'))
+            except validator.HashingBusy as e:
+                flash(str(e), 'error')
+                return render_template('register.html'), e.status
             except sqlite3.Error as e:
                 flash(f'Error registering user: {e}', 'error')
 
@@ -93,282 +204,326 @@ def login():
 
         try:
             with get_db() as conn:
-                cursor = conn.cursor()
-
-                select_query = '''
-                SELECT * FROM users WHERE username = ?;
+                select_query = f'''
+                SELECT {rows.LoginRow.columns} FROM users WHERE username = ?;
                 '''
 
-                cursor.execute(select_query, (username,))
-                user = cursor.fetchone()
+                user = rows.LoginRow.select(conn, select_query, (username,)).fetchone()
+
+            if user and validator.check_password(user.password, password, client=request.remote_addr):
+                if validator.needs_rehash(user.password):
+                    rehash_password(user.id, password)
 
-                if user and validator.check_password(user[4], password):  # Assuming hashed password is in the fifth column
-                    user_object = User()
-                    user_object.id = user[0]
-                    login_user(user_object)
-                    flash('Login successful!', 'success')
-                    return redirect(url_for('dashboard'))
-                else:
-                    flash('Invalid username or password. Please try again.', 'error')
+                user_object = User()
+                user_object.id = user.id
+                login_user(user_object)
+                flash('Login successful!', 'success')
+                return redirect(url_for('dashboard'))
+            else:
+                flash('Invalid username or password. Please try again.', 'error')
 
+        except validator.HashingBusy as e:
+            flash(str(e), 'error')
+            return render_template('login.html'), e.status
         except sqlite3.Error as e:
             flash(f'Error during login: {e}', 'error')
 
     return render_template('login.html')
 
 
+# Upgrade a stored hash to the current method after a successful login
+def rehash_password(user_id, password):
+    try:
+        hashed_password = validator.hash_password(password, client=request.remote_addr)
+
+        with get_db() as conn:
+            cursor = conn.cursor()
+
+            update_query = '''
+            UPDATE users SET password = ? WHERE id = ?;
+            '''
+
+            cursor.execute(update_query, (hashed_password, user_id))
+            conn.commit()
+
+        cache.invalidate_user(user_id)
+    except (validator.HashingBusy, sqlite3.Error):
+        # The old hash still works, so try again on a later login
+        pass
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     user_id = current_user.id
 
-    # Fetch user details from the database
-    user = get_user_by_id(user_id)
-
-    if user:
-        # Fetch recent activity
-        recent_orders = get_recent_orders(user_id)
-        recent_views = get_recent_product_views(user_id)
-        recent_posts = get_recent_forum_posts(user_id)
-
-        # Fetch personalized recommendations based on purchase history and browsing behavior
-        recommendations = get_personalized_recommendations(user_id)
-
-        # Fetch user statistics
-        user_statistics = get_user_statistics(user_id)
+    # Fetch user details, recent activity, recommendations and statistics together
+    data, errors = load_dashboard(user_id, concurrent=app.config['DASHBOARD_CONCURRENT'])
+    for error in errors:
+        flash(error, 'error')
 
+    if data['user']:
         # Render the dashboard template with the retrieved information
-        return render_template('dashboard.html', user=user, recent_orders=recent_orders,
-                               recent_views=recent_views, recent_posts=recent_posts,
-                               recommendations=recommendations, user_statistics=user_statistics)
+        return render_template('dashboard.html', **data)
     else:
         flash('User not found. Please log in again.', 'error')
         return redirect(url_for('login'))
 
 
-def get_recent_orders(user_id):
-    try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-
-            select_query = '''
-            SELECT * FROM orders
-            WHERE user_id = ?
-            ORDER BY order_date DESC
-            LIMIT 5;
-            '''
-
-            cursor.execute(select_query, (user_id,))
-            recent_orders = cursor.fetchall()
-
-            return recent_orders
-
-    except sqlite3.Error as e:
-        flash(f'Error fetching recent orders: {e}', 'error')
-        return None
-
+@app.route('/products')
+def view_products():
+    # Get filter, sort, search and pagination parameters from the request
+    category_filter = request.args.get('category', type=int)
+    price_range_filter = request.args.get('price_range')
+    min_rating = request.args.get('min_rating', type=float)
+    sort_by = request.args.get('sort_by')
+    search_query = request.args.get('search_query')
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', catalog.DEFAULT_PAGE_SIZE, type=int)
+    snippets = request.args.get('snippets', '0') == '1'
 
-def get_recent_product_views(user_id):
+    # Repeat polls are answered from the products version before any query runs
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
+        with get_read_db() as conn:
+            etag = versions.table_etag(conn, 'products', category_filter, price_range_filter, min_rating, sort_by,
+                                       search_query, cursor, per_page, snippets)
+    except sqlite3.Error:
+        etag = None
+    if etag:
+        cached = not_modified(etag, versions.PRIVATE_CACHE_CONTROL)
+        if cached:
+            return cached
 
-            select_query = '''
-            SELECT product_name FROM product_views
-            WHERE user_id = ?
-            ORDER BY view_date DESC
-            LIMIT 5;
-            '''
+    # Fetch filtered and sorted products
+    products, next_cursor = get_all_products(category_filter, price_range_filter, sort_by, search_query,
+                                             cursor=cursor, per_page=per_page, snippets=snippets,
+                                             min_rating=min_rating, version=etag)
 
-            cursor.execute(select_query, (user_id,))
-            recent_product_views = [row[0] for row in cursor.fetchall()]
+    response = make_response(render_template('products.html', products=products, next_cursor=next_cursor))
+    if etag and products is not None:
+        tag_response(response, etag, versions.PRIVATE_CACHE_CONTROL)
+    return response
 
-            return recent_product_views
 
+def get_all_products(category_filter=None, price_range_filter=None, sort_by=None, search_query=None, cursor=None, per_page=catalog.DEFAULT_PAGE_SIZE, snippets=False, min_rating=None, version=None):
+    try:
+        min_price, max_price = catalog.parse_price_range(price_range_filter)
+
+        def load_products():
+            with get_read_db() as conn:
+                return catalog.query_products(conn, category_id=category_filter, min_price=min_price,
+                                              max_price=max_price, min_rating=min_rating, search_query=search_query,
+                                              sort_by=sort_by, cursor=cursor, limit=per_page,
+                                              snippets=snippets)
+
+        # Listing pages are served from the catalog cache until a product write.
+        # The version is part of the key so a page is never tagged newer than it is.
+        key = ('products', version, category_filter, min_price, max_price, min_rating, sort_by, search_query, cursor, per_page, snippets)
+        return cache.catalog_cache.get_or_load(key, load_products)
+
+    except catalog.CatalogQueryError as e:
+        flash(f'Invalid product query: {e}', 'error')
+        return None, None
     except sqlite3.Error as e:
-        flash(f'Error fetching recent product views: {e}', 'error')
-        return None
+        flash(f'Error fetching products: {e}', 'error')
+        return None, None
 
 
-def get_recent_forum_posts(user_id):
+# Get a single product
+@app.route('/products/<int:product_id>')
+def get_product(product_id):
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-
-            select_query = '''
-            SELECT post_content FROM forum_posts
-            WHERE user_id = ?
-            ORDER BY post_date DESC
-            LIMIT 5;
-            '''
+        def load_product():
+            with get_read_db() as conn:
+                return catalog.get_product(conn, product_id)
 
-            cursor.execute(select_query, (user_id,))
-            recent_forum_posts = [row[0] for row in cursor.fetchall()]
+        product = cache.catalog_cache.get_or_load(('product', product_id), load_product)
+        if product is None:
+            return jsonify({'error': 'Product not found'}), 404
 
-            return recent_forum_posts
+        # Views are buffered and written in batches, off the request path
+        if current_user.is_authenticated:
+            writebehind.view_queue.put((current_user.id, product_id, sessions.timestamp()))
 
-    except sqlite3.Error as e:
-        flash(f'Error fetching recent forum posts: {e}', 'error')
-        return None
-
-
-def get_personalized_recommendations(user_id):
-    try:
+        # Holds change with every cart, so availability is never cached;
+        # it is one aggregate over the hold index on the primary
         with get_db() as conn:
-            cursor = conn.cursor()
+            available = holds.available_stock(conn, product_id)
 
-            # Placeholder logic: Recommend products based on the user's most purchased category
-            select_query = '''
-            SELECT p.product_name
-            FROM orders o
-            JOIN products p ON o.category_id = p.category_id
-            WHERE o.user_id = ?
-            ORDER BY o.order_date DESC
-            LIMIT 5;
-            '''
-
-            cursor.execute(select_query, (user_id,))
-            personalized_recommendations = [row[0] for row in cursor.fetchall()]
-
-            return personalized_recommendations
+        # A single row is cheap to hash, so its ETag comes from its content
+        etag = versions.make_etag('product', tuple(product), available)
+        cached = not_modified(etag, versions.PUBLIC_CACHE_CONTROL)
+        if cached:
+            return cached
 
+        return tag_response(jsonify({'product': product, 'available_quantity': available}), etag,
+                            versions.PUBLIC_CACHE_CONTROL)
     except sqlite3.Error as e:
-        flash(f'Error generating personalized recommendations: {e}', 'error')
-        return None
+        return jsonify({'error': f'Error fetching product: {e}'}), 500
 
 
-def get_user_statistics(user_id):
+# Store-wide totals for the admin dashboard
+@app.route('/admin/stats')
+@admin_required
+def admin_stats():
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
-
-            # Calculate total spending
-            total_spending_query = '''
-            SELECT SUM(total_price) FROM orders
-            WHERE user_id = ?;
-            '''
-
-            cursor.execute(total_spending_query, (user_id,))
-            total_spending = cursor.fetchone()[0] or 0
-
-            # Calculate total number of orders
-            total_orders_query = '''
-            SELECT COUNT(*) FROM orders
-            WHERE user_id = ?;
-            '''
-
-            cursor.execute(total_orders_query, (user_id,))
-            total_orders = cursor.fetchone()[0] or 0
-
-            # Create a dictionary with user statistics
-            user_statistics = {
-                'total_spending': total_spending,
-                'total_orders': total_orders,
-            }
-
-            return user_statistics
-
+            return jsonify({'stats': stats.get_store_stats(conn)})
     except sqlite3.Error as e:
-        flash(f'Error calculating user statistics: {e}', 'error')
-        return None
+        return jsonify({'error': f'Error fetching store stats: {e}'}), 500
 
 
-@app.route('/products')
-def view_products():
-    # Get filter, sort, and search parameters from the request
-    category_filter = request.args.get('category')
-    price_range_filter = request.args.get('price_range')
-    sort_by = request.args.get('sort_by')
-    search_query = request.args.get('search_query')
+# Stream a table export as NDJSON or CSV in constant memory. Exports hold
+# every user's rows, so they are admin only.
+@app.route('/export/<table>')
+@admin_required
+def export_table(table):
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in export.FORMATS:
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
 
-    # Fetch filtered and sorted products
-    products = get_all_products(category_filter, price_range_filter, sort_by, search_query)
-
-    return render_template('products.html', products=products)
-
-
-def get_all_products(category_filter=None, price_range_filter=None, sort_by=None, search_query=None, page=1, per_page=10):
     try:
+        select_query, params, columns = export.build_export_query(table,
+                                                                  after_id=request.args.get('after_id', type=int),
+                                                                  since=request.args.get('since'),
+                                                                  until=request.args.get('until'))
+    except export.ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        # The connection is held only while the response body is being sent
         with get_db() as conn:
-            cursor = conn.cursor()
-
-            # Base query
-            select_query = '''
-            SELECT * FROM products
-            '''
-
-            # Apply filters
-            filters = []
-            if category_filter:
-                filters.append(f"category = '{category_filter}'")
-            if price_range_filter:
-                filters.append(f"price {price_range_filter}")
-
-            if filters:
-                select_query += ' WHERE ' + ' AND '.join(filters)
-
-            # Apply search
-            if search_query:
-                select_query += f" AND (product_name LIKE '%{search_query}%' OR description LIKE '%{search_query}%')"
-
-            # Apply sorting
-            if sort_by:
-                select_query += f" ORDER BY {sort_by}"
-
-            # Add pagination
-            offset = (page - 1) * per_page
-            select_query += f" LIMIT {per_page} OFFSET {offset}"
-
-            cursor.execute(select_query)
-            products = cursor.fetchall()
-
-            return products
-
-    except sqlite3.Error as e:
-        flash(f'Error fetching products: {e}', 'error')
-        return None
-
-
-# Create a new order
+            batches = export.iter_rows(conn, select_query, params)
+            yield from export.WRITERS[export_format](batches, columns)
+
+    filename = f'{table}.{export_format}'
+    return Response(stream_with_context(generate()), mimetype=export.FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+# Rebuild every product's rating summary from reviews: flask --app routes backfill-ratings
+@app.cli.command('backfill-ratings')
+def backfill_ratings_command():
+    with get_db() as conn:
+        ratings.backfill_product_ratings(conn)
+    print('Product ratings rebuilt')
+
+
+# Rebuild co-purchase recommendations (needs NumPy and SciPy): flask --app routes build-recommendations
+@app.cli.command('build-recommendations')
+def build_recommendations_command():
+    import recommender
+
+    with get_db() as conn:
+        print(recommender.build_recommendations(conn))
+
+
+# Recount the admin stats and fix any drift: flask --app routes reconcile-stats
+@app.cli.command('reconcile-stats')
+def reconcile_stats_command():
+    with get_db() as conn:
+        drift = stats.reconcile_store_stats(conn)
+    print(f'Corrected drift: {drift}' if drift else 'Store stats are consistent')
+
+
+# Upsert a CSV or NDJSON supplier feed on sku: flask --app routes import-products feed.csv --checkpoint feed.ckpt
+@app.cli.command('import-products')
+@click.argument('feed', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'feed_format', type=click.Choice(importer.FORMATS), help='Defaults to the file extension')
+@click.option('--batch-size', default=importer.BATCH_SIZE, show_default=True)
+@click.option('--checkpoint', help='Progress file; rerun with the same file to resume')
+@click.option('--defer-indexes', is_flag=True, help='Drop and rebuild product indexes (large initial loads)')
+@click.option('--no-new-categories', is_flag=True, help='Leave products of unknown categories uncategorized')
+def import_products_command(feed, feed_format, batch_size, checkpoint, defer_indexes, no_new_categories):
+    if feed_format is None:
+        feed_format = 'ndjson' if feed.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+    def progress(state, processed, seconds):
+        print(f"{state['records']} records, {state['upserted']} upserted, {state['rejected']} rejected, "
+              f"{processed / seconds:.0f} rows/s")
+
+    with open(feed, newline='', encoding='utf-8') as f, get_db() as conn:
+        summary = importer.import_products(conn, f, feed_format, batch_size=batch_size, checkpoint=checkpoint,
+                                           create_categories=not no_new_categories,
+                                           defer_indexes=defer_indexes, progress=progress)
+    print(json.dumps(summary, indent=2))
+
+
+# Grant or revoke admin access: flask --app routes set-admin <username> [--revoke]
+@app.cli.command('set-admin')
+@click.argument('username')
+@click.option('--revoke', is_flag=True, help='Remove admin access instead')
+def set_admin_command(username, revoke):
+    with get_db() as conn:
+        updated = conn.execute('UPDATE users SET is_admin = ? WHERE username = ?;',
+                               (0 if revoke else 1, username)).rowcount
+        conn.commit()
+    if not updated:
+        raise click.ClickException(f'No such user: {username}')
+    print(f"{username} is {'no longer' if revoke else 'now'} an admin")
+
+
+# Apply pending schema migrations: flask --app routes migrate
+@app.cli.command('migrate')
+def migrate_command():
+    applied = migrations.ensure_schema()
+    print(f'Applied migrations: {applied}' if applied else 'Schema is up to date')
+
+
+# Backfill the product search index: flask --app routes rebuild-search-index
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    rebuild_product_search_index()
+    print('Product search index rebuilt')
+
+
+# Create a new order from the user's cart
+@app.route('/checkout', methods=['POST'])
 @app.route('/create_order', methods=['POST'])
 @login_required
 def create_order():
     user_id = current_user.id
-    try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-            total_price = request.form['total_price']
-            status = request.form['status']
 
-            insert_query = '''
-                INSERT INTO orders (user_id, total_price, status) VALUES (?, ?, ?);
-            '''
-
-            cursor.execute(insert_query, (user_id, total_price, status))
-            conn.commit()
+    @db.retry_on_busy
+    def place_order():
+        with get_db() as conn:
+            # The total is computed from the cart and current prices, never taken from the client
+            return checkout.checkout(conn, user_id)
 
-            return jsonify({'message': 'Order created successfully'})
+    try:
+        order_id, total_price = place_order()
+
+        return jsonify({'message': 'Order created successfully', 'order_id': order_id, 'total_price': total_price})
+    except (checkout.EmptyCartError, checkout.InvalidCartError) as e:
+        return jsonify({'error': str(e)}), 400
+    except checkout.OutOfStockError as e:
+        return jsonify({'error': str(e), 'product_ids': e.product_ids}), 409
+    except db.DatabaseBusy as e:
+        return jsonify({'error': f'Database busy, try again: {e}'}), 503, {'Retry-After': '1'}
     except sqlite3.Error as e:
         return jsonify({'error': f'Error creating order: {e}'}), 500
 
 
-# Get all orders for a user
+# Get a page of orders for a user
 @app.route('/get_user_orders')
 @login_required
 def get_user_orders():
     user_id = current_user.id
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
+            cursor = request.args.get('cursor')
+            limit = request.args.get('limit', pagination.DEFAULT_LIMIT, type=int)
 
-            select_query = '''
-                SELECT * FROM orders WHERE user_id = ?;
-            '''
+            etag = versions.user_etag(conn, user_id, 'orders', cursor, limit)
+            cached = not_modified(etag, versions.PRIVATE_CACHE_CONTROL)
+            if cached:
+                return cached
 
-            cursor.execute(select_query, (user_id,))
-            orders = cursor.fetchall()
+            orders, next_cursor = pagination.user_page(conn, rows.OrderRow, 'orders', user_id, cursor, limit)
 
-            return jsonify({'orders': orders})
+            return tag_response(jsonify({'orders': orders, 'next_cursor': next_cursor}), etag, versions.PRIVATE_CACHE_CONTROL)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({'error': f'Error fetching user orders: {e}'}), 500
 
@@ -389,6 +544,7 @@ def create_category():
 
             cursor.execute(insert_query, (name,))
             conn.commit()
+            cache.invalidate_categories()
 
             return jsonify({'message': 'Category created successfully'})
     except sqlite3.Error as e:
@@ -399,17 +555,23 @@ def create_category():
 @app.route('/get_categories')
 def get_categories():
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
+        with get_read_db() as conn:
+            etag = versions.table_etag(conn, 'categories')
+        cached = not_modified(etag, versions.CATEGORIES_CACHE_CONTROL)
+        if cached:
+            return cached
+
+        def load_categories():
+            with get_read_db() as conn:
+                select_query = f'''
+                    SELECT {rows.CategoryRow.columns} FROM categories;
+                '''
 
-            select_query = '''
-                SELECT * FROM categories;
-            '''
+                return rows.CategoryRow.select(conn, select_query).fetchall()
 
-            cursor.execute(select_query)
-            categories = cursor.fetchall()
+        categories = cache.catalog_cache.get_or_load(('categories', etag), load_categories, ttl=cache.CATEGORIES_TTL)
 
-            return jsonify({'categories': categories})
+        return tag_response(jsonify({'categories': categories}), etag, versions.CATEGORIES_CACHE_CONTROL)
     except sqlite3.Error as e:
         return jsonify({'error': f'Error fetching categories: {e}'}), 500
 
@@ -420,22 +582,63 @@ def get_categories():
 def add_to_cart():
     user_id = current_user.id
     try:
+        product_id, quantity = cart.parse_item(request.form.get('product_id'), request.form.get('quantity'))
+    except cart.CartError as e:
+        return jsonify({'error': str(e)}), 400
+
+    @db.retry_on_busy
+    def add_item():
         with get_db() as conn:
-            cursor = conn.cursor()
+            # The cart line and its stock hold are written in one short transaction
+            cart.add_item(conn, user_id, product_id, quantity, app.config['HOLD_TTL'])
 
-            product_id = request.form['product_id']
-            quantity = request.form['quantity']
+    try:
+        add_item()
+
+        return jsonify({'message': 'Product added to cart successfully'})
+    except holds.InvalidHoldError as e:
+        return jsonify({'error': str(e), 'product_ids': e.product_ids}), 400
+    except holds.UnknownProductError as e:
+        return jsonify({'error': str(e), 'product_ids': e.product_ids}), 404
+    except holds.InsufficientStockError as e:
+        return jsonify({'error': str(e), 'product_ids': e.product_ids}), 409
+    except db.DatabaseBusy as e:
+        return jsonify({'error': f'Database busy, try again: {e}'}), 503, {'Retry-After': '1'}
+    except sqlite3.Error as e:
+        return jsonify({'error': f'Error adding to cart: {e}'}), 500
 
-            insert_query = '''
-                INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, ?);
-            '''
 
-            cursor.execute(insert_query, (user_id, product_id, quantity))
-            conn.commit()
+# Add or update many cart entries in one request
+@app.route('/update_cart', methods=['POST'])
+@login_required
+def update_cart():
+    user_id = current_user.id
+    payload = request.get_json(silent=True) or {}
+    try:
+        items = cart.parse_items(payload.get('items'))
+    except cart.CartError as e:
+        return jsonify({'error': str(e)}), 400
+
+    @db.retry_on_busy
+    def update_items():
+        with get_db() as conn:
+            return cart.upsert_cart_items(conn, user_id, items, replace=payload.get('mode') == 'set',
+                                          hold_ttl=app.config['HOLD_TTL'])
 
-            return jsonify({'message': 'Product added to cart successfully'})
+    try:
+        updated, removed = update_items()
+
+        return jsonify({'message': 'Cart updated successfully', 'updated': updated, 'removed': removed})
+    except holds.InvalidHoldError as e:
+        return jsonify({'error': str(e), 'product_ids': e.product_ids}), 400
+    except holds.UnknownProductError as e:
+        return jsonify({'error': str(e), 'product_ids': e.product_ids}), 404
+    except holds.InsufficientStockError as e:
+        return jsonify({'error': str(e), 'product_ids': e.product_ids}), 409
+    except db.DatabaseBusy as e:
+        return jsonify({'error': f'Database busy, try again: {e}'}), 503, {'Retry-After': '1'}
     except sqlite3.Error as e:
-        return jsonify({'error': f'Error adding to cart: {e}'}), 500
+        return jsonify({'error': f'Error updating cart: {e}'}), 500
 
 
 # Get user's cart
@@ -445,16 +648,19 @@ def get_user_cart():
     user_id = current_user.id
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
+            cursor = request.args.get('cursor')
+            limit = request.args.get('limit', pagination.DEFAULT_LIMIT, type=int)
 
-            select_query = '''
-                SELECT * FROM carts WHERE user_id = ?;
-            '''
+            etag = versions.user_etag(conn, user_id, 'carts', cursor, limit)
+            cached = not_modified(etag, versions.PRIVATE_CACHE_CONTROL)
+            if cached:
+                return cached
 
-            cursor.execute(select_query, (user_id,))
-            user_cart = cursor.fetchall()
+            user_cart, next_cursor = pagination.user_page(conn, rows.CartRow, 'carts', user_id, cursor, limit)
 
-            return jsonify({'user_cart': user_cart})
+            return tag_response(jsonify({'user_cart': user_cart, 'next_cursor': next_cursor}), etag, versions.PRIVATE_CACHE_CONTROL)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({'error': f'Error fetching user cart: {e}'}), 500
 
@@ -464,13 +670,20 @@ def get_user_cart():
 def add_review():
     user_id = current_user.id
     try:
+        product_id = int(request.form['product_id'])
+        rating = int(request.form['rating'])
+        review_text = request.form['review_text']
+    except ValueError:
+        return jsonify({'error': 'product_id and rating must be integers'}), 400
+    if rating not in ratings.STARS:
+        return jsonify({'error': 'Rating must be between 1 and 5'}), 400
+
+    @db.retry_on_busy
+    def insert_review():
         with get_db() as conn:
             cursor = conn.cursor()
 
-            product_id = request.form['product_id']
-            rating = request.form['rating']
-            review_text = request.form['review_text']
-
+            # The product's rating summary is updated by trigger in the same transaction
             insert_query = '''
                 INSERT INTO reviews (user_id, product_id, rating, review_text) VALUES (?, ?, ?, ?);
             '''
@@ -478,11 +691,27 @@ def add_review():
             cursor.execute(insert_query, (user_id, product_id, rating, review_text))
             conn.commit()
 
-            return jsonify({'message': 'Review added successfully'})
+    try:
+        insert_review()
+        cache.invalidate_products(product_id)
+
+        return jsonify({'message': 'Review added successfully'})
+    except db.DatabaseBusy as e:
+        return jsonify({'error': f'Database busy, try again: {e}'}), 503, {'Retry-After': '1'}
     except sqlite3.Error as e:
         return jsonify({'error': f'Error adding review: {e}'}), 500
 
 
+# Get a product's rating summary
+@app.route('/products/<int:product_id>/ratings')
+def get_product_ratings(product_id):
+    try:
+        with get_read_db() as conn:
+            return jsonify({'ratings': ratings.get_product_rating(conn, product_id)})
+    except sqlite3.Error as e:
+        return jsonify({'error': f'Error fetching product ratings: {e}'}), 500
+
+
 # Get user's reviews
 @app.route('/get_user_reviews')
 @login_required
@@ -490,16 +719,19 @@ def get_user_reviews():
     user_id = current_user.id
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
+            cursor = request.args.get('cursor')
+            limit = request.args.get('limit', pagination.DEFAULT_LIMIT, type=int)
 
-            select_query = '''
-                SELECT * FROM reviews WHERE user_id = ?;
-            '''
+            etag = versions.user_etag(conn, user_id, 'reviews', cursor, limit)
+            cached = not_modified(etag, versions.PRIVATE_CACHE_CONTROL)
+            if cached:
+                return cached
 
-            cursor.execute(select_query, (user_id,))
-            user_reviews = cursor.fetchall()
+            user_reviews, next_cursor = pagination.user_page(conn, rows.ReviewRow, 'reviews', user_id, cursor, limit)
 
-            return jsonify({'user_reviews': user_reviews})
+            return tag_response(jsonify({'user_reviews': user_reviews, 'next_cursor': next_cursor}), etag, versions.PRIVATE_CACHE_CONTROL)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({'error': f'Error fetching user reviews: {e}'}), 500
 
@@ -540,16 +772,19 @@ def get_user_addresses():
     user_id = current_user.id
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
+            cursor = request.args.get('cursor')
+            limit = request.args.get('limit', pagination.DEFAULT_LIMIT, type=int)
 
-            select_query = '''
-                SELECT * FROM addresses WHERE user_id = ?;
-            '''
+            etag = versions.user_etag(conn, user_id, 'addresses', cursor, limit)
+            cached = not_modified(etag, versions.PRIVATE_CACHE_CONTROL)
+            if cached:
+                return cached
 
-            cursor.execute(select_query, (user_id,))
-            user_addresses = cursor.fetchall()
+            user_addresses, next_cursor = pagination.user_page(conn, rows.AddressRow, 'addresses', user_id, cursor, limit)
 
-            return jsonify({'user_addresses': user_addresses})
+            return tag_response(jsonify({'user_addresses': user_addresses, 'next_cursor': next_cursor}), etag, versions.PRIVATE_CACHE_CONTROL)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({'error': f'Error fetching user addresses: {e}'}), 500
 
@@ -559,15 +794,16 @@ def get_user_addresses():
 @login_required
 def add_payment():
     user_id = current_user.id
-    try:
+    order_id = request.form['order_id']
+    payment_method = request.form['payment_method']
+    transaction_id = request.form['transaction_id']
+    payment_status = request.form['payment_status']
+
+    @db.retry_on_busy
+    def insert_payment():
         with get_db() as conn:
             cursor = conn.cursor()
 
-            order_id = request.form['order_id']
-            payment_method = request.form['payment_method']
-            transaction_id = request.form['transaction_id']
-            payment_status = request.form['payment_status']
-
             insert_query = '''
                 INSERT INTO payments (user_id, order_id, payment_method, transaction_id, payment_status)
                 VALUES (?, ?, ?, ?, ?);
@@ -576,7 +812,12 @@ def add_payment():
             cursor.execute(insert_query, (user_id, order_id, payment_method, transaction_id, payment_status))
             conn.commit()
 
-            return jsonify({'message': 'Payment added successfully'})
+    try:
+        insert_payment()
+
+        return jsonify({'message': 'Payment added successfully'})
+    except db.DatabaseBusy as e:
+        return jsonify({'error': f'Database busy, try again: {e}'}), 503, {'Retry-After': '1'}
     except sqlite3.Error as e:
         return jsonify({'error': f'Error adding payment: {e}'}), 500
 
@@ -588,16 +829,19 @@ def get_user_payments():
     user_id = current_user.id
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
+            cursor = request.args.get('cursor')
+            limit = request.args.get('limit', pagination.DEFAULT_LIMIT, type=int)
 
-            select_query = '''
-                SELECT * FROM payments WHERE user_id = ?;
-            '''
+            etag = versions.user_etag(conn, user_id, 'payments', cursor, limit)
+            cached = not_modified(etag, versions.PRIVATE_CACHE_CONTROL)
+            if cached:
+                return cached
 
-            cursor.execute(select_query, (user_id,))
-            user_payments = cursor.fetchall()
+            user_payments, next_cursor = pagination.user_page(conn, rows.PaymentRow, 'payments', user_id, cursor, limit)
 
-            return jsonify({'user_payments': user_payments})
+            return tag_response(jsonify({'user_payments': user_payments, 'next_cursor': next_cursor}), etag, versions.PRIVATE_CACHE_CONTROL)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({'error': f'Error fetching user payments: {e}'}), 500
 
@@ -607,13 +851,18 @@ def get_user_payments():
 @login_required
 def add_session():
     user_id = current_user.id
+    try:
+        session_token = request.form['session_token']
+        expiration_date = request.form.get('expiration_date')
+        expiration_date = (sessions.normalize_expiration(expiration_date) if expiration_date
+                           else sessions.expires_in(app.config['SESSION_TTL']))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     try:
         with get_db() as conn:
             cursor = conn.cursor()
 
-            session_token = request.form['session_token']
-            expiration_date = request.form['expiration_date']
-
             insert_query = '''
                 INSERT INTO sessions (user_id, session_token, expiration_date)
                 VALUES (?, ?, ?);
@@ -623,10 +872,32 @@ def add_session():
             conn.commit()
 
             return jsonify({'message': 'Session added successfully'})
+    except sqlite3.IntegrityError:
+        return jsonify({'error': 'Session token already exists'}), 409
     except sqlite3.Error as e:
         return jsonify({'error': f'Error adding session: {e}'}), 500
 
 
+# Check a session token and slide its expiry
+@app.route('/validate_session', methods=['POST'])
+def validate_session():
+    session_token = request.form.get('session_token')
+    if not session_token:
+        return jsonify({'error': 'session_token is required'}), 400
+
+    try:
+        with get_db() as conn:
+            user_id = sessions.validate_session(conn, session_token,
+                                                ttl=app.config['SESSION_TTL'],
+                                                touch_interval=app.config['SESSION_TOUCH_INTERVAL'])
+            if user_id is None:
+                return jsonify({'valid': False}), 401
+
+            return jsonify({'valid': True, 'user_id': user_id})
+    except sqlite3.Error as e:
+        return jsonify({'error': f'Error validating session: {e}'}), 500
+
+
 # Get user's sessions
 @app.route('/get_user_sessions')
 @login_required
@@ -634,31 +905,30 @@ def get_user_sessions():
     user_id = current_user.id
     try:
         with get_db() as conn:
-            cursor = conn.cursor()
+            cursor = request.args.get('cursor')
+            limit = request.args.get('limit', pagination.DEFAULT_LIMIT, type=int)
 
-            select_query = '''
-                SELECT * FROM sessions WHERE user_id = ?;
-            '''
+            etag = versions.user_etag(conn, user_id, 'sessions', cursor, limit)
+            cached = not_modified(etag, versions.PRIVATE_CACHE_CONTROL)
+            if cached:
+                return cached
 
-            cursor.execute(select_query, (user_id,))
-            user_sessions = cursor.fetchall()
+            user_sessions, next_cursor = pagination.user_page(conn, rows.SessionRow, 'sessions', user_id, cursor, limit)
 
-            return jsonify({'user_sessions': user_sessions})
+            return tag_response(jsonify({'user_sessions': user_sessions, 'next_cursor': next_cursor}), etag, versions.PRIVATE_CACHE_CONTROL)
+    except pagination.PaginationError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.Error as e:
         return jsonify({'error': f'Error fetching user sessions: {e}'}), 500
 
 
 if __name__ == '__main__':
     try:
-        create_user_table()
-        create_products_table()
-        create_categories_table()
-        create_orders_table()
-        create_carts_table()
-        create_reviews_table()
-        create_addresses_table()
-        create_payments_table()
-        create_sessions_table()
+        migrations.ensure_schema()
+        db.configure_replica(app.config['READ_REPLICA_INTERVAL'])
+        stats.start_reconciler(app.config['STATS_RECONCILE_INTERVAL'])
+        sessions.start_sweeper(app.config['SESSION_SWEEP_INTERVAL'], app.config['SESSION_SWEEP_BATCH'])
+        holds.start_sweeper(app.config['HOLD_SWEEP_INTERVAL'], app.config['HOLD_SWEEP_BATCH'])
         app.run(debug=True)
     except Exception as e:
         print("An error occurred:", e)
@@ -0,0 +1,79 @@
+from flask.json.provider import DefaultJSONProvider
+
+
+class Row:
+    """Compact named row: one attribute slot per selected column.
+
+    Subclasses list their columns in ``_fields``; ``columns`` is the
+    matching SELECT list so queries and row shapes cannot drift apart.
+    Trailing columns that a query did not select are left as None.
+    """
+
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, *values):
+        for field, value in zip(self._fields, values):
+            setattr(self, field, value)
+        for field in self._fields[len(values):]:
+            setattr(self, field, None)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.columns = ', '.join(cls._fields)
+
+    @classmethod
+    def factory(cls, cursor, row):
+        # sqlite3 row_factory signature
+        return cls(*row)
+
+    @classmethod
+    def select(cls, conn, query, params=()):
+        cursor = conn.cursor()
+        cursor.row_factory = cls.factory
+        return cursor.execute(query, params)
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self._fields)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        values = ', '.join(f'{field}={getattr(self, field)!r}' for field in self._fields)
+        return f'{type(self).__name__}({values})'
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+
+def row_type(name, fields):
+    return type(name, (Row,), {'_fields': tuple(fields), '__slots__': tuple(fields)})
+
+
+# Public column sets per table. Password hashes are only ever selected by
+# LoginRow, which is used for credential checks and never serialized.
+UserRow = row_type('UserRow', ('id', 'username', 'name', 'email', 'date_added'))
+LoginRow = row_type('LoginRow', ('id', 'password'))
+IdentityRow = row_type('IdentityRow', ('id', 'is_admin'))
+ProductRow = row_type('ProductRow', ('id', 'name', 'description', 'price', 'stock_quantity', 'category_id', 'date_added',
+                                     'avg_rating', 'rating_count', 'snippet'))
+CategoryRow = row_type('CategoryRow', ('id', 'name'))
+OrderRow = row_type('OrderRow', ('id', 'user_id', 'total_price', 'order_date', 'status'))
+CartRow = row_type('CartRow', ('id', 'user_id', 'product_id', 'quantity', 'date_added'))
+ReviewRow = row_type('ReviewRow', ('id', 'user_id', 'product_id', 'rating', 'review_text', 'date_added'))
+AddressRow = row_type('AddressRow', ('id', 'user_id', 'address_line1', 'address_line2', 'city', 'state', 'zip_code', 'country', 'date_added'))
+PaymentRow = row_type('PaymentRow', ('id', 'user_id', 'order_id', 'payment_method', 'transaction_id', 'payment_status', 'date_added'))
+SessionRow = row_type('SessionRow', ('id', 'user_id', 'session_token', 'expiration_date', 'date_created'))
+
+
+class RowJSONProvider(DefaultJSONProvider):
+    # Serialize rows as objects without sorting keys, so the output keeps
+    # column order and skips a sort per row
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Row):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
@@ -0,0 +1,78 @@
+import re
+
+FTS_TABLE = 'products_fts'
+
+# External-content FTS5 index over products(name, description). The
+# index stores only tokens; the text itself stays in products.
+CREATE_FTS_TABLE = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name,
+        description,
+        content='products',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+'''
+
+FTS_TRIGGERS = {
+    'products_fts_ai': f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END;
+    ''',
+    'products_fts_ad': f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END;
+    ''',
+    'products_fts_au': f'''
+        CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+            INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO {FTS_TABLE} (rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END;
+    ''',
+}
+
+# bm25 column weights: a hit in the name counts more than one in the description.
+# Stored as the table's default rank so queries can refer to it as plain `rank`.
+# The catalog orders by (rank, id) for stable cursors, which FTS5 cannot serve
+# from its own ordering: every match is scored and sorted in a temp B-tree, so
+# search cost grows with the number of matches (not the catalog size) and a
+# broad term costs far more than a selective one.
+RANK_FUNCTION = 'bm25(10.0, 1.0)'
+RANK_EXPRESSION = f'{FTS_TABLE}.rank'
+
+SNIPPET_EXPRESSION = f"snippet({FTS_TABLE}, -1, '<b>', '</b>', '...', 12)"
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def create_search_index(conn):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_FTS_TABLE)
+    cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', ?);", (RANK_FUNCTION,))
+    for trigger_query in FTS_TRIGGERS.values():
+        cursor.execute(trigger_query)
+
+
+def drop_search_triggers(conn):
+    for trigger_name in FTS_TRIGGERS:
+        conn.execute(f'DROP TRIGGER IF EXISTS {trigger_name};')
+
+
+def rebuild_search_index(conn):
+    # Re-reads every row of products; used to backfill and after bulk loads
+    conn.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild');")
+
+
+def to_match_query(search_query):
+    # Turn free text into an FTS5 query of quoted prefix terms so user
+    # input can never be parsed as FTS5 syntax.
+    tokens = _TOKEN_PATTERN.findall(search_query or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
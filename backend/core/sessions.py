@@ -0,0 +1,118 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import db
+
+SESSION_TTL = 7 * 24 * 3600.0
+TOUCH_INTERVAL = 300.0
+SWEEP_INTERVAL = 60.0
+SWEEP_BATCH = 500
+SWEEP_PAUSE = 0.05
+MAX_TRACKED_TOUCHES = 100000
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Covers every column the auth check reads, so it never touches the table.
+# The planner would pick the unique token index, hence INDEXED BY.
+LOOKUP_INDEX = 'idx_sessions_token_user_expiration'
+
+VALIDATE_QUERY = f'''
+    SELECT user_id FROM sessions INDEXED BY {LOOKUP_INDEX}
+    WHERE session_token = ? AND expiration_date > ?;
+'''
+
+TOUCH_QUERY = '''
+    UPDATE sessions SET expiration_date = MAX(expiration_date, ?)
+    WHERE session_token = ? AND expiration_date > ?;
+'''
+
+SWEEP_QUERY = '''
+    DELETE FROM sessions WHERE id IN (
+        SELECT id FROM sessions WHERE expiration_date <= ? LIMIT ?
+    );
+'''
+
+# token -> monotonic time of the last expiry write for that session
+_last_touch = {}
+_touch_lock = threading.Lock()
+
+
+def timestamp(moment=None):
+    # Same UTC text format SQLite uses for CURRENT_TIMESTAMP
+    moment = moment or datetime.now(timezone.utc)
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def expires_in(seconds):
+    return timestamp(datetime.now(timezone.utc) + timedelta(seconds=seconds))
+
+
+def normalize_expiration(value):
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid expiration date: {value}')
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime(TIMESTAMP_FORMAT)
+
+
+def create_session_index(conn):
+    # Keep the newest row for any token that was stored more than once
+    conn.execute('''
+        DELETE FROM sessions WHERE id NOT IN (
+            SELECT MAX(id) FROM sessions GROUP BY session_token
+        );
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_token ON sessions (session_token);')
+    conn.execute('DROP INDEX IF EXISTS idx_sessions_session_token;')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expiration_date ON sessions (expiration_date);')
+
+
+def create_session_lookup_index(conn):
+    # idx_sessions_token stays: it is what keeps tokens unique
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {LOOKUP_INDEX} ON sessions (session_token, user_id, expiration_date);')
+
+
+def _should_touch(session_token, interval):
+    now = time.monotonic()
+    with _touch_lock:
+        last = _last_touch.get(session_token)
+        if last is not None and now - last < interval:
+            return False
+        if len(_last_touch) >= MAX_TRACKED_TOUCHES:
+            _last_touch.clear()
+        _last_touch[session_token] = now
+        return True
+
+
+def validate_session(conn, session_token, ttl=SESSION_TTL, touch_interval=TOUCH_INTERVAL):
+    """Return the user id for a live session token, or None.
+
+    Validation is a single unique-index lookup. Sliding expiry is written
+    at most once per ``touch_interval`` per token from this process, so
+    busy sessions do not turn every auth check into a write.
+    """
+    now = timestamp()
+    row = conn.execute(VALIDATE_QUERY, (session_token, now)).fetchone()
+    if row is None:
+        return None
+
+    if _should_touch(session_token, touch_interval):
+        conn.execute(TOUCH_QUERY, (expires_in(ttl), session_token, now))
+        conn.commit()
+
+    return row[0]
+
+
+def forget_session(session_token):
+    with _touch_lock:
+        _last_touch.pop(session_token, None)
+
+
+def sweep_expired(conn, batch_size=SWEEP_BATCH, pause=SWEEP_PAUSE):
+    return db.delete_in_batches(conn, SWEEP_QUERY, (timestamp(),), batch_size, pause)
+
+
+def start_sweeper(interval=SWEEP_INTERVAL, batch_size=SWEEP_BATCH):
+    return db.start_sweeper('session-sweeper', sweep_expired, interval, batch_size)
@@ -0,0 +1,102 @@
+import db
+from db import transaction
+
+# Store-wide counters for the admin dashboard, kept current by triggers on
+# the tables they summarize so reading them never scans those tables.
+STATS_QUERIES = {
+    'total_sales': 'SELECT COALESCE(SUM(total_price), 0) FROM orders',
+    'order_count': 'SELECT COUNT(*) FROM orders',
+    'product_count': 'SELECT COUNT(*) FROM products',
+    'user_count': 'SELECT COUNT(*) FROM users',
+}
+
+STATS_TRIGGERS = {
+    'store_stats_orders_ai': '''
+        CREATE TRIGGER IF NOT EXISTS store_stats_orders_ai AFTER INSERT ON orders BEGIN
+            UPDATE store_stats SET value = value + new.total_price WHERE name = 'total_sales';
+            UPDATE store_stats SET value = value + 1 WHERE name = 'order_count';
+        END;
+    ''',
+    'store_stats_orders_ad': '''
+        CREATE TRIGGER IF NOT EXISTS store_stats_orders_ad AFTER DELETE ON orders BEGIN
+            UPDATE store_stats SET value = value - old.total_price WHERE name = 'total_sales';
+            UPDATE store_stats SET value = value - 1 WHERE name = 'order_count';
+        END;
+    ''',
+    'store_stats_orders_au': '''
+        CREATE TRIGGER IF NOT EXISTS store_stats_orders_au AFTER UPDATE OF total_price ON orders BEGIN
+            UPDATE store_stats SET value = value + new.total_price - old.total_price WHERE name = 'total_sales';
+        END;
+    ''',
+    'store_stats_products_ai': '''
+        CREATE TRIGGER IF NOT EXISTS store_stats_products_ai AFTER INSERT ON products BEGIN
+            UPDATE store_stats SET value = value + 1 WHERE name = 'product_count';
+        END;
+    ''',
+    'store_stats_products_ad': '''
+        CREATE TRIGGER IF NOT EXISTS store_stats_products_ad AFTER DELETE ON products BEGIN
+            UPDATE store_stats SET value = value - 1 WHERE name = 'product_count';
+        END;
+    ''',
+    'store_stats_users_ai': '''
+        CREATE TRIGGER IF NOT EXISTS store_stats_users_ai AFTER INSERT ON users BEGIN
+            UPDATE store_stats SET value = value + 1 WHERE name = 'user_count';
+        END;
+    ''',
+    'store_stats_users_ad': '''
+        CREATE TRIGGER IF NOT EXISTS store_stats_users_ad AFTER DELETE ON users BEGIN
+            UPDATE store_stats SET value = value - 1 WHERE name = 'user_count';
+        END;
+    ''',
+}
+
+RECONCILE_INTERVAL = 3600.0
+
+
+def create_store_stats(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS store_stats (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+    ''')
+    conn.executemany('INSERT OR IGNORE INTO store_stats (name) VALUES (?);', [(name,) for name in STATS_QUERIES])
+    for trigger_query in STATS_TRIGGERS.values():
+        conn.execute(trigger_query)
+    _recompute(conn)
+
+
+def _recompute(conn):
+    drift = {}
+    current = dict(conn.execute('SELECT name, value FROM store_stats;').fetchall())
+    for name, select_query in STATS_QUERIES.items():
+        actual = conn.execute(select_query).fetchone()[0]
+        # Revenue is a float sum, so only a difference of a cent or more is drift
+        if current.get(name) is None or round(current[name] - actual, 2) != 0:
+            drift[name] = actual - (current.get(name) or 0)
+            conn.execute('UPDATE store_stats SET value = ? WHERE name = ?;', (actual, name))
+    return drift
+
+
+def get_store_stats(conn):
+    stats = dict(conn.execute('SELECT name, value FROM store_stats;').fetchall())
+    for name in ('order_count', 'product_count', 'user_count'):
+        stats[name] = int(stats.get(name, 0))
+    return stats
+
+
+def reconcile_store_stats(conn):
+    # Full recount under the write lock; returns the corrections applied
+    with transaction(conn):
+        return _recompute(conn)
+
+
+def _reconcile(conn, _batch_size):
+    drift = reconcile_store_stats(conn)
+    if drift:
+        print("Corrected store stats drift:", drift)
+
+
+def start_reconciler(interval=RECONCILE_INTERVAL):
+    # A full recount has no batches; the sweeper's batch size goes unused
+    return db.start_sweeper('store-stats-reconciler', _reconcile, interval, None)
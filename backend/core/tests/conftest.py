@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import db
+import migrations
+from routes import app
+
+
+@pytest.fixture
+def database(tmp_path):
+    # A fresh migrated database per test, with room for every test thread
+    db.configure(str(tmp_path / 'site.db'), size=64)
+    migrations.ensure_schema()
+    cache.catalog_cache.clear()
+    cache.identity_cache.clear()
+    yield db
+    db.get_pool().close()
+
+
+@pytest.fixture
+def add_users(database):
+    def add(count):
+        with db.get_db() as conn:
+            start = conn.execute('SELECT COALESCE(MAX(id), 0) FROM users;').fetchone()[0] + 1
+            conn.executemany('INSERT INTO users (id, username, name, email, password) VALUES (?, ?, ?, ?, ?);',
+                             [(user_id, f'user{user_id}', 'Test User', f'user{user_id}@example.com', 'x')
+                              for user_id in range(start, start + count)])
+            conn.commit()
+        return list(range(start, start + count))
+    return add
+
+
+@pytest.fixture
+def add_product(database):
+    def add(stock_quantity, price=10.0):
+        with db.get_db() as conn:
+            product_id = conn.execute(
+                "INSERT INTO products (name, description, price, stock_quantity) VALUES ('Product', '', ?, ?);",
+                (price, stock_quantity)).lastrowid
+            conn.commit()
+        return product_id
+    return add
+
+
+def client_for(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+    return client
+
+
+def run_concurrently(func, args_list):
+    """Run func once per argument tuple, all threads released together; returns the results in order."""
+    barrier = threading.Barrier(len(args_list))
+    results = [None] * len(args_list)
+    errors = []
+
+    def run(index, args):
+        barrier.wait()
+        try:
+            results[index] = func(*args)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index, args)) for index, args in enumerate(args_list)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,45 @@
+import pytest
+from db import get_db
+from conftest import client_for
+from routes import app
+
+
+@pytest.fixture
+def admin_id(add_users):
+    user_id, = add_users(1)
+    with get_db() as conn:
+        conn.execute('UPDATE users SET is_admin = 1 WHERE id = ?;', (user_id,))
+        conn.commit()
+    return user_id
+
+
+def test_admin_stats_requires_admin(add_users, admin_id):
+    user_id, = add_users(1)
+
+    assert app.test_client().get('/admin/stats').status_code in (302, 401)
+    assert client_for(user_id).get('/admin/stats').status_code == 403
+
+    response = client_for(admin_id).get('/admin/stats')
+    assert response.status_code == 200
+    assert response.get_json()['stats']['user_count'] == 2
+
+
+def test_set_admin_command(add_users):
+    user_id, = add_users(1)
+    runner = app.test_cli_runner()
+
+    assert runner.invoke(args=['set-admin', f'user{user_id}']).exit_code == 0
+    assert client_for(user_id).get('/admin/stats').status_code == 200
+    assert runner.invoke(args=['set-admin', 'nobody']).exit_code != 0
+
+
+@pytest.mark.parametrize('table', ['users', 'orders', 'payments'])
+def test_exports_require_admin(add_users, admin_id, table):
+    user_id, = add_users(1)
+
+    assert client_for(user_id).get(f'/export/{table}').status_code == 403
+
+    response = client_for(admin_id).get(f'/export/{table}')
+    assert response.status_code == 200
+    if table == 'users':
+        assert b'@example.com' in response.data
@@ -0,0 +1,19 @@
+from cache import approximate_size
+from rows import ProductRow
+
+
+def product_values(index):
+    return (index, f'Product {index}', f'Product {index}: ' + 'a fairly long description ' * 28, 9.99 + index, 5, 1,
+            '2024-01-01 00:00:00', 4.5, 10, None)
+
+
+def test_approximate_size_counts_slot_rows_like_tuples():
+    page = [ProductRow(*product_values(index)) for index in range(50)]
+    as_tuples = [product_values(index) for index in range(50)]
+
+    row_size = approximate_size((page, 'next-cursor'))
+    tuple_size = approximate_size((as_tuples, 'next-cursor'))
+
+    # Each row carries a ~700 byte description, all of which must be counted
+    assert row_size > 50 * 700
+    assert 0.5 < row_size / tuple_size < 2
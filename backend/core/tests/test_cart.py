@@ -0,0 +1,71 @@
+import sqlite3
+import pytest
+import cart
+import db
+from db import get_db
+from conftest import client_for
+
+
+@pytest.mark.parametrize('item', [
+    {'product_id': 1, 'quantity': 1.9},
+    {'product_id': 1, 'quantity': True},
+    {'product_id': 1, 'quantity': '2'},
+    {'product_id': 1.0, 'quantity': 1},
+    {'product_id': 1},
+])
+def test_update_cart_rejects_non_integer_items(add_users, add_product, item):
+    user_id, = add_users(1)
+    add_product(stock_quantity=5)
+
+    response = client_for(user_id).post('/update_cart', json={'items': [item]})
+
+    assert response.status_code == 400
+    with get_db() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM carts;').fetchone()[0] == 0
+
+
+def test_unknown_product_is_not_found(add_users, add_product):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+    client = client_for(user_id)
+
+    response = client.post('/update_cart', json={'items': [{'product_id': product_id, 'quantity': 1},
+                                                           {'product_id': 999, 'quantity': 1}]})
+    assert response.status_code == 404
+    assert response.get_json()['product_ids'] == [999]
+
+    assert client.post('/add_to_cart', data={'product_id': 999, 'quantity': 1}).status_code == 404
+    with get_db() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM carts;').fetchone()[0] == 0
+
+
+def test_update_cart_sets_and_removes_lines(add_users, add_product):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+    client = client_for(user_id)
+
+    assert client.post('/update_cart', json={'items': [{'product_id': product_id, 'quantity': 2}] * 2}).status_code == 200
+    with get_db() as conn:
+        assert conn.execute('SELECT quantity FROM carts;').fetchall() == [(4,)]
+
+    response = client.post('/update_cart', json={'items': [{'product_id': product_id, 'quantity': 0}], 'mode': 'set'})
+    assert response.get_json()['removed'] == 1
+    with get_db() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM stock_holds;').fetchone()[0] == 0
+
+
+def test_update_cart_retries_then_reports_busy(add_users, add_product, monkeypatch):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+    attempts = []
+
+    def locked(*args, **kwargs):
+        attempts.append(1)
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(cart, 'upsert_cart_items', locked)
+    response = client_for(user_id).post('/update_cart', json={'items': [{'product_id': product_id, 'quantity': 1}]})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert len(attempts) == db.BUSY_RETRIES
@@ -0,0 +1,34 @@
+import pytest
+from db import get_db
+import catalog
+from catalog import CatalogQueryError, encode_cursor
+
+
+@pytest.mark.parametrize('sort_by, value, last_id', [
+    ('newest', ['2024-01-01'], 1),
+    ('newest', {'a': 1}, 1),
+    ('newest', 5, 1),
+    ('price_asc', '10', 1),
+    ('price_asc', True, 1),
+    ('rating', 4.5, '1'),
+    ('rating', 4.5, 1.0),
+])
+def test_tampered_cursor_is_rejected(sort_by, value, last_id):
+    with pytest.raises(CatalogQueryError, match='Invalid cursor'):
+        catalog.build_product_query(sort_by=sort_by, cursor=encode_cursor(sort_by, value, last_id))
+
+
+@pytest.mark.parametrize('sort_by', ['newest', 'price_asc', 'rating'])
+def test_cursor_pages_through_every_product(add_product, sort_by):
+    product_ids = [add_product(stock_quantity=1, price=float(price)) for price in (3, 1, 2, 2, 5)]
+
+    seen = []
+    cursor = None
+    with get_db() as conn:
+        while True:
+            page, cursor = catalog.query_products(conn, sort_by=sort_by, cursor=cursor, limit=2)
+            seen.extend(row.id for row in page)
+            if not cursor:
+                break
+
+    assert sorted(seen) == sorted(product_ids)
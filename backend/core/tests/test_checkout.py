@@ -0,0 +1,93 @@
+import pytest
+from collections import Counter
+from db import get_db
+from conftest import client_for, run_concurrently
+import cache
+import stats
+
+
+def stock_of(product_id):
+    with get_db() as conn:
+        return conn.execute('SELECT stock_quantity FROM products WHERE id = ?;', (product_id,)).fetchone()[0]
+
+
+@pytest.mark.parametrize('quantity', ['-3', '0', 'abc', '2.5', ''])
+def test_add_to_cart_rejects_invalid_quantity(add_users, add_product, quantity):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+
+    response = client_for(user_id).post('/add_to_cart', data={'product_id': product_id, 'quantity': quantity})
+
+    assert response.status_code == 400
+    with get_db() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM carts;').fetchone()[0] == 0
+
+
+def test_checkout_refuses_non_positive_lines(add_users, add_product):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+    with get_db() as conn:
+        conn.execute('INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, -3);', (user_id, product_id))
+        conn.commit()
+
+    response = client_for(user_id).post('/checkout')
+
+    assert response.status_code == 400
+    assert 'Invalid cart quantity' in response.get_json()['error']
+    assert stock_of(product_id) == 5
+    with get_db() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM orders;').fetchone()[0] == 0
+        assert stats.get_store_stats(conn).get('total_sales', 0) == 0
+
+
+def test_concurrent_checkouts_never_oversell(add_users, add_product):
+    stock = 20
+    user_ids = add_users(50)
+    product_id = add_product(stock_quantity=stock, price=3.0)
+    with get_db() as conn:
+        conn.executemany('INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, 1);',
+                         [(user_id, product_id) for user_id in user_ids])
+        conn.commit()
+
+    clients = [client_for(user_id) for user_id in user_ids]
+    statuses = run_concurrently(lambda client: client.post('/checkout').status_code,
+                                [(client,) for client in clients])
+
+    assert Counter(statuses) == {200: stock, 409: len(user_ids) - stock}
+    assert stock_of(product_id) == 0
+    with get_db() as conn:
+        assert conn.execute('SELECT SUM(quantity) FROM order_items;').fetchone()[0] == stock
+        assert stats.get_store_stats(conn)['total_sales'] == stock * 3.0
+        # Losers keep their carts; winners' carts are cleared
+        assert conn.execute('SELECT COUNT(*) FROM carts;').fetchone()[0] == len(user_ids) - stock
+
+
+def test_checkout_ignores_client_status(add_users, add_product):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+    with get_db() as conn:
+        conn.execute('INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, 1);', (user_id, product_id))
+        conn.commit()
+
+    response = client_for(user_id).post('/checkout', data={'status': 'paid'})
+
+    assert response.status_code == 200
+    with get_db() as conn:
+        assert conn.execute('SELECT status FROM orders;').fetchone()[0] == 'pending'
+
+
+def test_checkout_invalidates_only_purchased_products(add_users, add_product):
+    user_id, = add_users(1)
+    bought, untouched = add_product(stock_quantity=5), add_product(stock_quantity=5)
+    with get_db() as conn:
+        conn.execute('INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, 1);', (user_id, bought))
+        conn.commit()
+    cache.catalog_cache.set(('product', bought), 'bought')
+    cache.catalog_cache.set(('product', untouched), 'untouched')
+    cache.catalog_cache.set(('products', 'listing'), 'listing')
+
+    assert client_for(user_id).post('/checkout').status_code == 200
+
+    assert cache.catalog_cache.get(('product', bought)) is None
+    assert cache.catalog_cache.get(('products', 'listing')) is None
+    assert cache.catalog_cache.get(('product', untouched)) == 'untouched'
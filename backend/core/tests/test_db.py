@@ -0,0 +1,28 @@
+import db
+
+
+def test_connection_returned_to_a_closed_pool_is_closed(tmp_path):
+    pool = db.ConnectionPool(str(tmp_path / 'pool.db'), size=2)
+    with pool.connection() as idle:
+        pass
+    with pool.connection() as held:
+        pool.close()
+        assert held.execute('SELECT 1;').fetchone() == (1,)
+
+    assert pool.stats()['open'] == 0
+    assert pool.stats()['idle'] == 0
+
+
+def test_replica_refresh_closes_connections_still_checked_out(database):
+    replica = db.SnapshotReplica(db.DATABASE, interval=3600, size=2)
+    replica.refresh()
+    try:
+        retired = replica.pool
+        with retired.connection() as conn:
+            replica.refresh()
+            assert conn.execute('SELECT COUNT(*) FROM products;').fetchone() is not None
+
+        assert retired.stats()['open'] == 0
+        assert replica.pool is not retired
+    finally:
+        replica.stop()
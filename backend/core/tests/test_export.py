@@ -0,0 +1,19 @@
+import pytest
+import export
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-03-01T12:00:00', '2024-03-01 12:00:00'),
+    ('2024-03-01T12:00:00+00:00', '2024-03-01 12:00:00'),
+    ('2024-03-01T14:30:00+02:00', '2024-03-01 12:30:00'),
+    ('2024-03-01T00:30:00-05:00', '2024-03-01 05:30:00'),
+])
+def test_since_is_normalized_to_utc(value, expected):
+    _, params, _ = export.build_export_query('orders', since=value)
+
+    assert params == [0, expected]
+
+
+def test_invalid_timestamp_is_an_export_error():
+    with pytest.raises(export.ExportError):
+        export.build_export_query('orders', until='yesterday')
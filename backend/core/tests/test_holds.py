@@ -0,0 +1,116 @@
+import sqlite3
+from collections import Counter
+import pytest
+from db import get_db
+from conftest import client_for, run_concurrently
+import cart
+import holds
+
+
+def held_and_carted(product_id):
+    with get_db() as conn:
+        held = conn.execute('SELECT COALESCE(SUM(quantity), 0) FROM stock_holds WHERE product_id = ?;',
+                            (product_id,)).fetchone()[0]
+        carted = conn.execute('SELECT COALESCE(SUM(quantity), 0) FROM carts WHERE product_id = ?;',
+                              (product_id,)).fetchone()[0]
+    return held, carted
+
+
+def test_concurrent_adds_on_one_sku_never_hold_more_than_stock(add_users, add_product):
+    stock = 37
+    user_ids = add_users(100)
+    product_id = add_product(stock_quantity=stock)
+    quantities = {user_id: 1 + user_id % 3 for user_id in user_ids}
+
+    def add(user_id):
+        return client_for(user_id).post('/add_to_cart', data={'product_id': product_id,
+                                                               'quantity': quantities[user_id]}).status_code
+
+    statuses = run_concurrently(add, [(user_id,) for user_id in user_ids])
+
+    assert set(statuses) <= {200, 409}
+    held, carted = held_and_carted(product_id)
+    granted = sum(quantities[user_id] for user_id, status in zip(user_ids, statuses) if status == 200)
+    # Refused adds roll back their cart line too
+    assert held == carted == granted
+    assert stock - max(quantities.values()) < held <= stock
+    with get_db() as conn:
+        assert holds.available_stock(conn, product_id) == stock - held
+
+
+def test_concurrent_add_and_checkout_on_one_sku_never_oversell(add_users, add_product):
+    stock = 20
+    user_ids = add_users(60)
+    product_id = add_product(stock_quantity=stock)
+
+    def buy(user_id):
+        client = client_for(user_id)
+        added = client.post('/add_to_cart', data={'product_id': product_id, 'quantity': 1}).status_code
+        return added, client.post('/checkout').status_code
+
+    results = run_concurrently(buy, [(user_id,) for user_id in user_ids])
+
+    assert Counter(results) == {(200, 200): stock, (409, 400): len(user_ids) - stock}
+    with get_db() as conn:
+        assert conn.execute('SELECT stock_quantity FROM products WHERE id = ?;', (product_id,)).fetchone()[0] == 0
+        assert conn.execute('SELECT SUM(quantity) FROM order_items;').fetchone()[0] == stock
+        assert conn.execute('SELECT COUNT(*) FROM stock_holds;').fetchone()[0] == 0
+
+
+@pytest.mark.parametrize('quantity', ['abc', '-2', '0'])
+def test_invalid_quantity_writes_no_hold(add_users, add_product, quantity):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+
+    response = client_for(user_id).post('/add_to_cart', data={'product_id': product_id, 'quantity': quantity})
+
+    assert response.status_code == 400
+    assert held_and_carted(product_id) == (0, 0)
+
+
+def test_non_positive_cart_line_is_never_held(add_users, add_product):
+    user_id, = add_users(1)
+    product_id = add_product(stock_quantity=5)
+    with get_db() as conn:
+        conn.execute('INSERT INTO carts (user_id, product_id, quantity) VALUES (?, ?, -3);', (user_id, product_id))
+        conn.commit()
+
+        with pytest.raises(holds.InvalidHoldError):
+            holds.hold_cart_lines(conn, user_id, [product_id])
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO stock_holds (user_id, product_id, quantity, expires_at) VALUES (?, ?, -3, '2100-01-01');",
+                         (user_id, product_id))
+        conn.rollback()
+        assert holds.available_stock(conn, product_id) == 5
+
+
+def test_expired_holds_free_stock_and_are_swept(add_users, add_product):
+    first, second = add_users(2)
+    product_id = add_product(stock_quantity=5)
+    with get_db() as conn:
+        cart.add_item(conn, first, product_id, 5, hold_ttl=-1)
+        assert holds.available_stock(conn, product_id) == 5
+
+        cart.add_item(conn, second, product_id, 5)
+        assert holds.available_stock(conn, product_id) == 0
+        assert holds.sweep_expired(conn, batch_size=1) == 1
+        assert conn.execute('SELECT user_id FROM stock_holds;').fetchall() == [(second,)]
+
+
+def test_quantity_check_migration_rebuilds_old_table(database):
+    with get_db() as conn:
+        conn.execute('DROP TABLE stock_holds;')
+        conn.execute('''
+            CREATE TABLE stock_holds (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+                                      product_id INTEGER NOT NULL, quantity INTEGER NOT NULL,
+                                      expires_at TIMESTAMP NOT NULL);
+        ''')
+        conn.executemany("INSERT INTO stock_holds (user_id, product_id, quantity, expires_at) VALUES (1, ?, ?, '2100-01-01');",
+                         [(1, 2), (2, -1)])
+
+        holds.add_quantity_check(conn)
+        conn.commit()
+
+        assert conn.execute('SELECT product_id, quantity FROM stock_holds;').fetchall() == [(1, 2)]
+        indexes = {row[1] for row in conn.execute('PRAGMA index_list(stock_holds);')}
+        assert set(holds.HOLD_INDEXES) <= indexes
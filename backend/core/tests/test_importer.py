@@ -0,0 +1,100 @@
+import io
+import json
+import pytest
+from db import get_db
+import catalog
+import importer
+import migrations
+import search
+
+
+def ndjson(*records):
+    return io.StringIO(''.join((record if isinstance(record, str) else json.dumps(record)) + '\n'
+                               for record in records))
+
+
+def product(sku, **fields):
+    return {'sku': sku, 'name': f'Widget {sku}', 'price': 1.5, 'stock_quantity': 3, **fields}
+
+
+def test_malformed_ndjson_line_is_rejected_and_import_continues(database):
+    feed = ndjson(product('a'), '{"sku": "b", "name": ', '', product('c'))
+
+    with get_db() as conn:
+        summary = importer.import_products(conn, feed, 'ndjson', batch_size=10)
+        skus = [row[0] for row in conn.execute('SELECT sku FROM products ORDER BY sku;')]
+
+    assert skus == ['a', 'c']
+    assert summary['upserted'] == 2
+    assert summary['rejected'] == 1
+    assert summary['errors'][0]['record'] == 2
+    assert 'invalid JSON' in summary['errors'][0]['error']
+
+
+def test_checkpoint_resume_skips_committed_lines(database, tmp_path):
+    checkpoint = str(tmp_path / 'import.checkpoint')
+    importer.write_checkpoint(checkpoint, {'records': 2, 'upserted': 2, 'rejected': 0})
+    feed = ndjson(product('a'), product('b'), product('c'))
+
+    with get_db() as conn:
+        summary = importer.import_products(conn, feed, 'ndjson', checkpoint=checkpoint)
+        skus = [row[0] for row in conn.execute('SELECT sku FROM products ORDER BY sku;')]
+
+    assert skus == ['c']
+    assert summary['resumed_from'] == 2
+    assert summary['upserted'] == 3
+
+
+def test_startup_restores_what_a_killed_import_dropped(database):
+    with get_db() as conn:
+        importer.import_products(conn, ndjson(product('a', name='Teapot')), 'ndjson')
+
+        # What a process killed mid-import leaves behind, including the FTS
+        # triggers older imports dropped too
+        for name in [*importer.DEFERRED_TRIGGERS, *search.FTS_TRIGGERS]:
+            conn.execute(f'DROP TRIGGER {name};')
+        for name in importer.PRODUCT_INDEXES:
+            conn.execute(f'DROP INDEX {name};')
+        conn.execute("INSERT INTO products (name, description, price, stock_quantity) VALUES ('Kettle', '', 1, 1);")
+        conn.commit()
+        assert importer.interrupted_import(conn)
+
+    migrations.ensure_schema()
+
+    with get_db() as conn:
+        assert importer.interrupted_import(conn) == []
+        found, _ = catalog.query_products(conn, search_query='kettle')
+        assert [row.name for row in found] == ['Kettle']
+
+
+def products_version(conn):
+    return conn.execute("SELECT version FROM table_versions WHERE name = 'products';").fetchone()[0]
+
+
+def test_import_reindexes_changed_rows_and_bumps_version_per_batch(database):
+    with get_db() as conn:
+        importer.import_products(conn, ndjson(product('a', name='Teapot'), product('b', name='Kettle')), 'ndjson')
+        before = products_version(conn)
+        batches = []
+
+        # Batches of one: every committed batch is visible to ETags straight away
+        feed = ndjson(product('a', name='Teapot'), product('b', name='Toaster'), product('c', name='Mug'))
+        importer.import_products(conn, feed, 'ndjson', batch_size=1,
+                                 progress=lambda *_: batches.append(products_version(conn)))
+
+        assert batches == [before + 1, before + 2, before + 3]
+        assert products_version(conn) == before + 4
+        assert [row.name for row in catalog.query_products(conn, search_query='toaster')[0]] == ['Toaster']
+        assert catalog.query_products(conn, search_query='kettle')[0] == []
+        assert [row.name for row in catalog.query_products(conn, search_query='mug')[0]] == ['Mug']
+        # Raises if the index no longer matches the products table
+        conn.execute("INSERT INTO products_fts (products_fts) VALUES ('integrity-check');")
+        assert importer.interrupted_import(conn) == []
+
+
+def test_deferred_index_load_rebuilds_search_once(database):
+    with get_db() as conn:
+        importer.import_products(conn, ndjson(product('a', name='Teapot')), 'ndjson', defer_indexes=True)
+
+        assert importer.interrupted_import(conn) == []
+        assert [row.name for row in catalog.query_products(conn, search_query='teapot')[0]] == ['Teapot']
@@ -0,0 +1,74 @@
+import os
+import subprocess
+import sys
+import pytest
+from flask import g
+from flask_login import login_user
+import instrumentation
+from routes import app, User
+
+CORE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = '''
+import db, migrations
+from routes import app
+db.configure({database!r})
+migrations.ensure_schema()
+response = app.test_client().get('/metrics')
+print(app.config['INSTRUMENTATION_ENABLED'], 'X-Query-Count' in response.headers)
+'''
+
+
+def run_app(tmp_path, **env):
+    # Instrumentation is wired up at import time, so each setting gets a fresh interpreter
+    env = {**{key: value for key, value in os.environ.items() if not key.startswith('FLASK_')}, **env}
+    result = subprocess.run([sys.executable, '-c', CHECK.format(database=str(tmp_path / 'site.db'))],
+                            cwd=CORE, env=env, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def test_instrumentation_is_off_by_default(tmp_path):
+    assert run_app(tmp_path) == ['False', 'False']
+
+
+def test_instrumentation_enabled_from_environment(tmp_path):
+    assert run_app(tmp_path, FLASK_INSTRUMENTATION_ENABLED='true') == ['True', 'True']
+
+
+@pytest.fixture
+def profile_header(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'PROFILE_HEADER_ENABLED', True)
+    monkeypatch.setattr(instrumentation, 'PROFILE_TRUSTED_ADDRESSES', ('10.0.0.1',))
+
+
+def profile_requested(remote_addr='203.0.113.9', admin=None):
+    with app.test_request_context(headers={'X-Profile': '1'}, environ_base={'REMOTE_ADDR': remote_addr}):
+        if admin is not None:
+            user = User()
+            user.id, user.is_admin = 1, admin
+            login_user(user)
+        return instrumentation._profile_requested()
+
+
+def test_profile_header_is_ignored_unless_enabled():
+    assert not profile_requested(remote_addr='10.0.0.1', admin=True)
+
+
+def test_profile_header_needs_an_admin_or_trusted_address(profile_header):
+    assert not profile_requested()
+    assert not profile_requested(admin=False)
+    assert profile_requested(admin=True)
+    assert profile_requested(remote_addr='10.0.0.1')
+
+
+def test_profiling_skips_requests_while_another_profile_runs(profile_header):
+    with app.test_request_context(headers={'X-Profile': '1'}, environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        with instrumentation._profiler_lock:
+            instrumentation._before_request()
+            assert 'profiler' not in g
+
+        instrumentation._before_request()
+        assert 'profiler' in g
+        instrumentation._teardown_request(None)
+        assert 'profiler' not in g
+        assert not instrumentation._profiler_lock.locked()
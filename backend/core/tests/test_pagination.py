@@ -0,0 +1,40 @@
+import pytest
+from db import get_db
+from conftest import client_for
+from pagination import encode_cursor
+
+
+@pytest.mark.parametrize('values', [
+    [{'a': 1}, 1],
+    ['2024-01-01 00:00:00', [1]],
+    ['2024-01-01 00:00:00', '1'],
+    ['2024-01-01 00:00:00', True],
+    [1.5, 1],
+    ['2024-01-01 00:00:00'],
+])
+def test_tampered_cursor_is_rejected(add_users, values):
+    user_id, = add_users(1)
+
+    response = client_for(user_id).get('/get_user_orders', query_string={'cursor': encode_cursor(values)})
+
+    assert response.status_code == 400
+
+
+def test_cursor_pages_through_orders(add_users):
+    user_id, = add_users(1)
+    with get_db() as conn:
+        conn.executemany("INSERT INTO orders (user_id, total_price, status) VALUES (?, 1.0, 'pending');",
+                         [(user_id,)] * 5)
+        conn.commit()
+    client = client_for(user_id)
+
+    seen = []
+    cursor = None
+    while True:
+        body = client.get('/get_user_orders', query_string={'limit': 2, **({'cursor': cursor} if cursor else {})}).get_json()
+        seen.extend(order['id'] for order in body['orders'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+
+    assert seen == [5, 4, 3, 2, 1]
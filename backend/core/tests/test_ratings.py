@@ -0,0 +1,17 @@
+from db import get_db
+import ratings
+
+
+def test_product_rating_summary(add_users, add_product):
+    user_ids = add_users(3)
+    product_id = add_product(stock_quantity=1)
+    with get_db() as conn:
+        conn.executemany("INSERT INTO reviews (user_id, product_id, rating, review_text) VALUES (?, ?, ?, 'ok');",
+                         [(user_id, product_id, rating) for user_id, rating in zip(user_ids, (5, 4, 5))])
+        conn.commit()
+
+        summary = ratings.get_product_rating(conn, product_id)
+
+    assert summary['rating_count'] == 3
+    assert summary['average'] == 14 / 3
+    assert summary['histogram'] == {1: 0, 2: 0, 3: 0, 4: 1, 5: 2}
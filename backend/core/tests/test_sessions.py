@@ -0,0 +1,17 @@
+from db import get_db
+import sessions
+
+
+def test_validate_session_is_index_only(add_users):
+    user_id, = add_users(1)
+    with get_db() as conn:
+        conn.execute('INSERT INTO sessions (user_id, session_token, expiration_date) VALUES (?, ?, ?);',
+                     (user_id, 'token', sessions.expires_in(60)))
+        conn.commit()
+
+        plan = ' '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sessions.VALIDATE_QUERY,
+                                                        ('token', sessions.timestamp())))
+        assert f'COVERING INDEX {sessions.LOOKUP_INDEX}' in plan
+
+        assert sessions.validate_session(conn, 'token') == user_id
+        assert sessions.validate_session(conn, 'other') is None
@@ -0,0 +1,29 @@
+from db import get_db
+import stats
+
+
+def set_total_sales(conn, value):
+    conn.execute("UPDATE store_stats SET value = ? WHERE name = 'total_sales';", (value,))
+    conn.commit()
+
+
+def test_reconcile_ignores_float_rounding_noise(add_users):
+    user_id, = add_users(1)
+    with get_db() as conn:
+        conn.executemany('INSERT INTO orders (user_id, total_price, status) VALUES (?, ?, ?);',
+                         [(user_id, 0.1, 'pending')] * 10)
+        conn.commit()
+        set_total_sales(conn, 1.0 + 1e-9)
+
+        assert stats.reconcile_store_stats(conn) == {}
+
+
+def test_reconcile_corrects_real_drift(add_users):
+    user_id, = add_users(1)
+    with get_db() as conn:
+        conn.execute('INSERT INTO orders (user_id, total_price, status) VALUES (?, 5.25, ?);', (user_id, 'pending'))
+        conn.commit()
+        set_total_sales(conn, 4.0)
+
+        assert stats.reconcile_store_stats(conn) == {'total_sales': 1.25}
+        assert stats.get_store_stats(conn)['total_sales'] == 5.25
@@ -0,0 +1,76 @@
+import hashlib
+import threading
+import time
+import pytest
+import validator
+from db import get_db
+from routes import app
+
+
+@pytest.fixture
+def hashing():
+    validator.configure_hashing(workers=2, max_pending=2, max_per_client=2, timeout=0.05)
+    yield
+    validator.configure_hashing(workers=validator.PASSWORD_HASH_WORKERS, max_pending=validator.PASSWORD_HASH_MAX_PENDING,
+                                max_per_client=validator.PASSWORD_HASH_MAX_PER_CLIENT, timeout=10.0)
+
+
+def wait_for_release(*clients):
+    # Slots are released by a done callback that may run just after result() returns
+    deadline = time.monotonic() + 5
+    while any(client in validator._per_client for client in clients) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_timeout_is_busy_and_keeps_its_slot_until_the_hash_finishes(hashing):
+    finish = threading.Event()
+
+    with pytest.raises(validator.HashingBusy) as busy:
+        validator._run_hashing('a', finish.wait)
+    assert busy.value.status == 503
+    assert 'a' in validator._per_client
+
+    # The timed-out hash is still running, so only one pending slot is left
+    validator._run_hashing('b', lambda: None)
+    wait_for_release('b')
+    with pytest.raises(validator.HashingBusy, match='timed out'):
+        validator._run_hashing('c', finish.wait)
+    with pytest.raises(validator.HashingBusy, match='busy'):
+        validator._run_hashing('d', lambda: None)
+
+    finish.set()
+    wait_for_release('a', 'c')
+    assert validator._run_hashing('d', lambda: 'done') == 'done'
+
+
+def test_per_client_limit_is_too_many_requests(hashing):
+    finish = threading.Event()
+    for _ in range(2):
+        with pytest.raises(validator.HashingBusy):
+            validator._run_hashing('a', finish.wait)
+
+    with pytest.raises(validator.HashingBusy) as busy:
+        validator._run_hashing('a', lambda: None)
+    assert busy.value.status == 429
+    finish.set()
+
+
+def test_legacy_sha256_login_succeeds_and_is_rehashed(add_users):
+    user_id, = add_users(1)
+    legacy = 'sha256$pepper$' + hashlib.sha256(b'pepperhunter2').hexdigest()
+    with get_db() as conn:
+        conn.execute('UPDATE users SET password = ? WHERE id = ?;', (legacy, user_id))
+        conn.commit()
+
+    response = app.test_client().post('/login', data={'username': f'user{user_id}', 'password': 'hunter2'})
+
+    assert response.status_code == 302
+    with get_db() as conn:
+        stored = conn.execute('SELECT password FROM users WHERE id = ?;', (user_id,)).fetchone()[0]
+    assert not validator.needs_rehash(stored)
+    assert validator.check_password(stored, 'hunter2')
+
+
+@pytest.mark.parametrize('stored', ['x', 'sha256$pepper$' + '0' * 64, 'md5$salt$abc', 'pbkdf2:bogus$salt$abc'])
+def test_unparseable_or_wrong_hashes_fail_the_check(stored):
+    assert validator.check_password(stored, 'hunter2') is False
@@ -1,6 +1,18 @@
+import hashlib
+import hmac
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Password hashing settings. Stored hashes whose method prefix differs from
+# PASSWORD_HASH_METHOD are rehashed on the next successful login.
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+PASSWORD_HASH_WORKERS = 4
+PASSWORD_HASH_MAX_PENDING = 64
+PASSWORD_HASH_MAX_PER_CLIENT = 2
+PASSWORD_HASH_TIMEOUT = 10.0
+
 def validate_registration(username, email, name, password1, password2):
     if not (username and email and name and password1 and password2):
         return 'All fields are required'
@@ -20,8 +32,90 @@ def validate_registration(username, email, name, password1, password2):
 
     return None # No errors
 
-def hash_password(password):
-    return generate_password_hash(password, method='sha256')
+class HashingBusy(Exception):
+    # 429 when one client has too many hashes in flight, 503 when the server does
+    def __init__(self, message, status=503):
+        super().__init__(message)
+        self.status = status
+
+# hashlib's scrypt and pbkdf2 release the GIL, so a small thread pool keeps
+# hashing off the request threads' CPU budget without a process pool.
+_hash_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+_pending = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+_per_client = {}
+_per_client_lock = threading.Lock()
+
+def configure_hashing(method=None, workers=None, max_pending=None, max_per_client=None, timeout=None):
+    global PASSWORD_HASH_METHOD, PASSWORD_HASH_MAX_PER_CLIENT, PASSWORD_HASH_TIMEOUT, _hash_pool, _pending
+    if method is not None:
+        PASSWORD_HASH_METHOD = method
+    if max_per_client is not None:
+        PASSWORD_HASH_MAX_PER_CLIENT = max_per_client
+    if timeout is not None:
+        PASSWORD_HASH_TIMEOUT = timeout
+    if workers is not None:
+        _hash_pool.shutdown(wait=False)
+        _hash_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+    if max_pending is not None:
+        _pending = threading.BoundedSemaphore(max_pending)
+
+def _release_client(client):
+    with _per_client_lock:
+        if _per_client[client] <= 1:
+            del _per_client[client]
+        else:
+            _per_client[client] -= 1
+
+def _run_hashing(client, function, *args):
+    # Per-client backpressure first, so one address cannot fill the shared queue
+    with _per_client_lock:
+        in_flight = _per_client.get(client, 0)
+        if in_flight >= PASSWORD_HASH_MAX_PER_CLIENT:
+            raise HashingBusy('Too many password attempts in progress, please retry shortly', status=429)
+        _per_client[client] = in_flight + 1
+
+    pending = _pending
+    if not pending.acquire(blocking=False):
+        _release_client(client)
+        raise HashingBusy('Server is busy, please retry shortly')
+    try:
+        future = _hash_pool.submit(function, *args)
+    except BaseException:
+        pending.release()
+        _release_client(client)
+        raise
+
+    # Slots are freed when the hash finishes, not when the caller gives up
+    # waiting, so hashes still running after a timeout count against both bounds
+    def release(_):
+        pending.release()
+        _release_client(client)
+
+    future.add_done_callback(release)
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        raise HashingBusy('Password check timed out, please retry shortly')
+
+def hash_password(password, client=None):
+    return _run_hashing(client, generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def _check_password_hash(hashed_password, password):
+    # Accounts from before werkzeug hashing store sha256(salt + password)
+    # as 'sha256$salt$hash'; needs_rehash upgrades them on login
+    method, _, rest = hashed_password.partition('$')
+    if method == 'sha256':
+        salt, _, expected = rest.partition('$')
+        actual = hashlib.sha256((salt + password).encode()).hexdigest()
+        return hmac.compare_digest(actual, expected)
+    try:
+        return check_password_hash(hashed_password, password)
+    except ValueError:
+        # An unknown method or a malformed hash is a failed check, not a 500
+        return False
+
+def check_password(hashed_password, password, client=None):
+    return _run_hashing(client, _check_password_hash, hashed_password, password)
 
-def check_password(hashed_password, password):
-    return check_password_hash(hashed_password, password)
+def needs_rehash(hashed_password):
+    return hashed_password.split('$', 1)[0] != PASSWORD_HASH_METHOD
@@ -0,0 +1,99 @@
+import hashlib
+from pagination import USER_LISTS
+
+# Version counters behind the ETags of read endpoints. Triggers bump a
+# counter on every write to a table (catalog tables) or to a user's rows
+# (per-user lists), so checking whether a client's copy is current is a
+# primary key lookup instead of the query that built it.
+CATALOG_TABLES = ('categories', 'products')
+USER_TABLES = tuple(USER_LISTS)
+
+# Cache-Control per kind of response. Everything else is revalidated with
+# its ETag; only the category list, which rarely changes, may be reused
+# unchecked for a minute. Rendered pages and per-user lists are private.
+CATEGORIES_CACHE_CONTROL = 'public, max-age=60'
+PUBLIC_CACHE_CONTROL = 'public, no-cache'
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+
+TABLE_VERSION_QUERY = '''
+    SELECT (SELECT version FROM table_versions WHERE name = 'epoch'),
+           (SELECT version FROM table_versions WHERE name = ?);
+'''
+
+USER_VERSION_QUERY = '''
+    SELECT (SELECT version FROM table_versions WHERE name = 'epoch'),
+           (SELECT version FROM user_versions WHERE user_id = ? AND name = ?);
+'''
+
+
+def _bump_table(table):
+    return f"UPDATE table_versions SET version = version + 1 WHERE name = '{table}';"
+
+
+def _bump_user(table, row):
+    return f'''
+        INSERT INTO user_versions (user_id, name, version) VALUES ({row}.user_id, '{table}', 1)
+        ON CONFLICT (user_id, name) DO UPDATE SET version = version + 1;
+    '''
+
+
+def _triggers():
+    triggers = {}
+    for table in CATALOG_TABLES:
+        for event, suffix in (('INSERT', 'ai'), ('UPDATE', 'au'), ('DELETE', 'ad')):
+            name = f'{table}_version_{suffix}'
+            triggers[name] = f'''
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+                    {_bump_table(table)}
+                END;
+            '''
+    for table in USER_TABLES:
+        for event, suffix, rows in (('INSERT', 'ai', ('new',)), ('UPDATE', 'au', ('old', 'new')),
+                                    ('DELETE', 'ad', ('old',))):
+            name = f'{table}_user_version_{suffix}'
+            body = ''.join(_bump_user(table, row) for row in rows)
+            triggers[name] = f'''
+                CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN
+                    {body}
+                END;
+            '''
+    return triggers
+
+
+VERSION_TRIGGERS = _triggers()
+
+
+def create_versions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID;
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, name)
+        ) WITHOUT ROWID;
+    ''')
+    # Random per database, so ETags from a recreated database never match
+    conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('epoch', abs(random()));")
+    conn.executemany('INSERT OR IGNORE INTO table_versions (name) VALUES (?);', [(table,) for table in CATALOG_TABLES])
+    for trigger_query in VERSION_TRIGGERS.values():
+        conn.execute(trigger_query)
+
+
+def make_etag(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def table_etag(conn, table, *parts):
+    epoch, version = conn.execute(TABLE_VERSION_QUERY, (table,)).fetchone()
+    return make_etag(epoch, table, version, *parts)
+
+
+def user_etag(conn, user_id, table, *parts):
+    epoch, version = conn.execute(USER_VERSION_QUERY, (user_id, table)).fetchone()
+    return make_etag(epoch, table, user_id, version or 0, *parts)
@@ -0,0 +1,152 @@
+import atexit
+import queue
+import threading
+import time
+from db import get_db, transaction
+
+FLUSH_ROWS = 500
+FLUSH_INTERVAL = 0.05
+CAPACITY = 10000
+BLOCK_TIMEOUT = 0.01
+
+
+class WriteBehindQueue:
+    """Buffer high-frequency inserts and write them in batches.
+
+    Rows are flushed with one executemany per transaction whenever
+    ``flush_rows`` are waiting or the oldest waiting row is
+    ``flush_interval`` seconds old. When the buffer is full, the 'drop'
+    policy discards the new row and 'block' waits up to ``block_timeout``
+    for room before discarding it. Whatever is buffered at interpreter
+    exit is flushed.
+    """
+
+    def __init__(self, name, insert_query, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL,
+                 capacity=CAPACITY, policy='drop', block_timeout=BLOCK_TIMEOUT):
+        if policy not in ('drop', 'block'):
+            raise ValueError(f'Unknown overflow policy: {policy}')
+
+        self.name = name
+        self.insert_query = insert_query
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self._queue = queue.Queue(maxsize=capacity)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'flushed_rows': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_seconds': 0.0,
+        }
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def put(self, row):
+        if self._thread is None:
+            self.start()
+        try:
+            if self.policy == 'block':
+                self._queue.put(row, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            self._bump('dropped')
+            return False
+        self._bump('enqueued')
+        return True
+
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            with get_db() as conn:
+                with transaction(conn):
+                    conn.executemany(self.insert_query, batch)
+        except Exception as e:
+            self._bump('flush_errors')
+            self._bump('dropped', len(batch))
+            print(f"Error flushing {self.name} write-behind batch:", e)
+            return
+        with self._stats_lock:
+            self._stats['flushed_rows'] += len(batch)
+            self._stats['flushes'] += 1
+            self._stats['last_flush_seconds'] = time.perf_counter() - started
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        # Write everything buffered right now from the calling thread
+        while True:
+            batch = []
+            while len(batch) < self.flush_rows:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+
+# Product page views: the highest-volume write in the app
+view_queue = WriteBehindQueue('product_views', '''
+    INSERT INTO product_views (user_id, product_id, view_date) VALUES (?, ?, ?);
+''')
+
+
+def configure_view_queue(**options):
+    global view_queue
+    view_queue.stop()
+    view_queue = WriteBehindQueue('product_views', view_queue.insert_query, **options)
+    return view_queue